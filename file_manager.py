@@ -1,8 +1,37 @@
 import os
+import re
 import sys
+import json
+import mmap
+import argparse
+import errno
+import time
 import shutil
+import sqlite3
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from collections.abc import Iterator
+from functools import lru_cache, partial
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+"""Defines a string type that marks the messages reporting a failed command."""
+
+
+class ErrorMessage(str):
+    pass
+
+
+"""Defines the exception raised inside a background job once the job has been cancelled."""
+
+
+class JobCancelledError(Exception):
+    pass
+
+
 """Defines a class for handling error messages related to file management operations."""
 
 
@@ -22,12 +51,22 @@ class Errors:
                 'WrongCommandError': 'Invalid command',
                 'DirectoryNotFoundError': 'Invalid directory',
                 'InvalidParameterError': 'Invalid parameter',
+                'InvalidJobError': 'No such job',
+                'InvalidBatchError': 'No such incomplete batch in the journal',
+                'ForegroundOnlyError': 'This command cannot run in the background',
+                'CurrentDirectoryRemovalError': 'Cannot remove the current directory or one of its parents',
+                'InvalidPatternError': 'Invalid pattern',
+                'InvalidConflictPolicyError': 'Invalid conflict policy, use one of: '
+                                              'ask, overwrite, skip, rename, newer, checksum',
                 FileNotFoundError: 'No such file or directory',
                 PermissionError: 'Permission denied',
                 FileExistsError: 'The directory already exists',
                 TypeError: 'Specify the current name of the file or directory and the new location and/or name'
             }
         }
+        for messages in self.errors.values():  # Marks every message so that batch runs can detect failures.
+            for key, message in messages.items():
+                messages[key] = ErrorMessage(message)
 
     def __call__(self, command):
         """Callable method that returns an error description based on the command."""
@@ -42,142 +81,1565 @@ class Errors:
 
 
 class Command:
-    def __init__(self, func, num_args, exist):
+    def __init__(self, func, num_args, exist, background=False):
         self.func = func  # The function to execute for this command.
         self.num_args = num_args  # The number of arguments this command expects.
         self.multiarg = exist  # Boolean indicating if the command can accept multiple arguments.
+        self.background = background  # Boolean indicating if the command can run as a background job.
+        self.recorder = None  # Optional callable measuring the command, receives the function and its arguments.
 
     def __call__(self, *args, **kwargs):
         """Callable method that executes the command's function with the provided arguments."""
+        if self.recorder is not None:
+            return self.recorder(self.func, *args, **kwargs)
         return self.func(*args, **kwargs)
 
 
+"""Defines a class that measures commands and aggregates their latency and I/O per command name."""
+
+
+class CommandStats:
+    # Audit events counted while a command runs, mapped to the name of their counter.
+    AUDIT_EVENTS = {
+        'os.scandir': 'scandir',
+        'os.listdir': 'scandir',
+        'os.remove': 'unlink',
+        'os.rmdir': 'rmdir',
+        'os.rename': 'rename',
+        'os.mkdir': 'mkdir',
+        'os.link': 'link',
+        'open': 'open',
+        'shutil.copyfile': 'copy',
+    }
+    COUNTERS = ('scandir', 'unlink', 'rmdir', 'rename', 'mkdir', 'link', 'open', 'copy')
+    # Events whose source and destination paths both count as files touched.
+    TWO_PATH_EVENTS = ('os.rename', 'os.link', 'shutil.copyfile')
+    _sessions = []  # (counters, touched paths) of the measurements in progress, shared by every instance.
+    _sessions_lock = threading.Lock()
+    _hook_installed = False
+
+    def __init__(self):
+        self.commands = {}  # Maps a command name to its aggregated measurements.
+        self._lock = threading.Lock()
+
+    def measure(self, name, func, *args, **kwargs):
+        """Runs func with the arguments and adds its wall time, I/O and system calls to the totals of name.
+
+        The counters are process-wide, so commands running at the same time, such as background jobs, see each
+        other's I/O. A command returning a generator is measured up to the creation of the generator.
+        """
+        self._install_hook()
+        session = (dict.fromkeys(self.COUNTERS, 0), set())
+        counters, touched = session
+        io_before = self._process_io()
+        with self._sessions_lock:
+            self._sessions.append(session)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._sessions_lock:
+                self._sessions.remove(session)
+            io_after = self._process_io()
+            with self._lock:
+                totals = self.commands.setdefault(name, dict(
+                    calls=0, total_s=0.0, max_s=0.0, read_bytes=0, written_bytes=0, read_calls=0, write_calls=0,
+                    files_touched=0, **dict.fromkeys(self.COUNTERS, 0)))
+                totals['calls'] += 1
+                totals['total_s'] += elapsed
+                totals['max_s'] = max(totals['max_s'], elapsed)
+                for key in ('read_bytes', 'written_bytes', 'read_calls', 'write_calls'):
+                    totals[key] += io_after[key] - io_before[key]
+                for key in self.COUNTERS:
+                    totals[key] += counters[key]
+                totals['files_touched'] += len(touched)
+
+    def reset(self):
+        """Drops every measurement."""
+        with self._lock:
+            self.commands.clear()
+
+    def table(self):
+        """Formats the totals as a table, the commands that took the longest first."""
+        columns = ('calls', 'total ms', 'max ms', 'read', 'written', 'scandir', 'unlink', 'files')
+        lines = [f'{"command":<10}' + ''.join(f'{column:>10}' for column in columns)]
+        with self._lock:
+            commands = sorted(self.commands.items(), key=lambda item: -item[1]['total_s'])
+        for name, totals in commands:
+            values = (totals['calls'], f'{totals["total_s"] * 1000:.1f}', f'{totals["max_s"] * 1000:.1f}',
+                      FileManager._human_readable_size(totals['read_bytes']),
+                      FileManager._human_readable_size(totals['written_bytes']),
+                      totals['scandir'], totals['unlink'], totals['files_touched'])
+            lines.append(f'{name:<10}' + ''.join(f'{value:>10}' for value in values))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        """Returns the totals as a JSON document keyed by command name."""
+        with self._lock:
+            return json.dumps(self.commands, indent=2, sort_keys=True)
+
+    @classmethod
+    def _install_hook(cls):
+        """Installs the audit hook counting system calls, once per process since hooks cannot be removed."""
+        with cls._sessions_lock:
+            if not cls._hook_installed:
+                sys.addaudithook(cls._audit)
+                cls._hook_installed = True
+
+    @classmethod
+    def _audit(cls, event, args):
+        """Audit hook adding an event to every measurement in progress, it returns at once when there is none."""
+        if not cls._sessions:
+            return
+        counter = cls.AUDIT_EVENTS.get(event)
+        if counter is None:
+            return
+        paths = args[:2] if event in cls.TWO_PATH_EVENTS else args[:1]
+        if counter == 'scandir':
+            paths = ()  # A listed directory is not a touched file.
+        paths = [os.fsdecode(path) for path in paths if isinstance(path, (str, bytes, os.PathLike))]
+        with cls._sessions_lock:
+            for counters, touched in cls._sessions:
+                counters[counter] += 1
+                touched.update(paths)
+
+    @staticmethod
+    def _process_io():
+        """Returns the bytes and read/write system calls of the process so far, zeros where unsupported.
+
+        Linux reports them in /proc/self/io, elsewhere getrusage block counts approximate the bytes.
+        """
+        try:
+            with open('/proc/self/io') as io:
+                values = dict(line.split(': ') for line in io.read().splitlines())
+            return {'read_bytes': int(values['rchar']), 'written_bytes': int(values['wchar']),
+                    'read_calls': int(values['syscr']), 'write_calls': int(values['syscw'])}
+        except (OSError, KeyError, ValueError):
+            try:
+                import resource
+                usage = resource.getrusage(resource.RUSAGE_SELF)
+                return {'read_bytes': usage.ru_inblock * 512, 'written_bytes': usage.ru_oublock * 512,
+                        'read_calls': 0, 'write_calls': 0}
+            except ImportError:
+                return dict.fromkeys(('read_bytes', 'written_bytes', 'read_calls', 'write_calls'), 0)
+
+
+"""Defines a class that copies files and switches to a kernel-side, resumable transfer above a size threshold."""
+
+
+class FileCopier:
+    LARGE_FILE_THRESHOLD = 64 * 1024 ** 2  # Files of at least this size are copied by the kernel.
+    CHUNK_SIZE = 16 * 1024 ** 2  # Bytes copied per system call, progress is reported after every chunk.
+    PARTIAL_SUFFIX = '.part'  # The partial copy is kept under this suffix, its size marks where to resume.
+    SOURCE_SUFFIX = '.source'  # Appended to the partial file's name for the record of the source being copied.
+    # Errors meaning the kernel or the filesystem cannot copy between these two files.
+    UNSUPPORTED_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+    def __init__(self, threshold=None, progress=None):
+        self.threshold = self.LARGE_FILE_THRESHOLD if threshold is None else threshold
+        self.progress = progress  # Optional callable receiving (file name, copied bytes, total bytes).
+
+    def __call__(self, source, destination):
+        """Copies a file together with its metadata.
+
+        The signature matches shutil.copy2, so the copier can also be passed to shutil.move as copy_function.
+        """
+        source, destination = Path(source), Path(destination)
+        if destination.is_dir():
+            destination = destination / source.name
+        if source.stat().st_size < self.threshold:
+            return shutil.copy2(source, destination)
+        self._copy_large_file(source, destination)
+        shutil.copystat(source, destination)
+        return destination
+
+    def _copy_large_file(self, source, destination):
+        """Copies a large file chunk by chunk into a partial file and renames it once complete.
+
+        The size, modification time and inode of the source are recorded next to the partial file. An interrupted
+        copy resumes from the end of the partial file only if the record matches the source, otherwise it starts over.
+        """
+        partial = destination.with_name(destination.name + self.PARTIAL_SUFFIX)
+        record = partial.with_name(partial.name + self.SOURCE_SUFFIX)
+        source_stat = source.stat()
+        total = source_stat.st_size
+        identity = f'{total} {source_stat.st_mtime_ns} {source_stat.st_dev} {source_stat.st_ino}'
+        try:
+            resumable = record.read_text() == identity
+        except OSError:
+            resumable = False
+        with open(source, 'rb') as src:
+            dst_fd = os.open(partial, os.O_WRONLY | os.O_CREAT, 0o644)
+            try:
+                offset = os.fstat(dst_fd).st_size
+                if not resumable or offset > total:
+                    os.ftruncate(dst_fd, 0)  # The partial file belongs to another source, or to nobody, start over.
+                    offset = 0
+                    record.write_text(identity)
+                while offset < total:
+                    copied = self._copy_chunk(src.fileno(), dst_fd, offset, min(self.CHUNK_SIZE, total - offset))
+                    if not copied:
+                        raise OSError(f"'{source.name}' was truncated while copying")
+                    offset += copied
+                    if self.progress:
+                        self.progress(source.name, offset, total)
+            finally:
+                os.close(dst_fd)
+        os.replace(partial, destination)
+        record.unlink(missing_ok=True)
+
+    def _copy_chunk(self, src_fd, dst_fd, offset, count):
+        """Copies count bytes at offset using copy_file_range, then sendfile, then plain reads and writes."""
+        if hasattr(os, 'copy_file_range'):
+            try:
+                return os.copy_file_range(src_fd, dst_fd, count, offset, offset)
+            except OSError as e:
+                if e.errno not in self.UNSUPPORTED_ERRORS:
+                    raise
+        os.lseek(dst_fd, offset, os.SEEK_SET)
+        if hasattr(os, 'sendfile'):
+            try:
+                return os.sendfile(dst_fd, src_fd, offset, count)
+            except OSError as e:
+                if e.errno not in self.UNSUPPORTED_ERRORS:
+                    raise
+        return os.write(dst_fd, os.pread(src_fd, count, offset))
+
+
+"""Defines a class that decides what happens when the destination of a copy or move already exists."""
+
+
+class ConflictPolicy:
+    POLICIES = ('ask', 'overwrite', 'skip', 'rename', 'newer', 'checksum')  # Supported policy names.
+    HASH_CHUNK_SIZE = 1024 ** 2  # Bytes read at a time when comparing the checksums of two files.
+
+    def __init__(self, policy='ask'):
+        if policy not in self.POLICIES:
+            raise ValueError(f'Unknown conflict policy: {policy}')
+        self.policy = policy
+
+    def __call__(self, source, destination):
+        """Returns the path the source should be written to, or None if the source must be skipped.
+
+        - ask: prompts the user for every conflicting file.
+        - overwrite: always replaces the existing file.
+        - skip: always keeps the existing file.
+        - rename: writes to a free name such as 'report (1).txt' next to the existing file.
+        - newer: replaces the existing file only if the source was modified more recently.
+        - checksum: keeps the existing file if its content is identical, replaces it otherwise.
+        """
+        if not destination.exists() or self.policy == 'overwrite':
+            return destination
+        if self.policy == 'skip':
+            return None
+        if self.policy == 'rename':
+            return self._free_name(destination)
+        if self.policy == 'newer':
+            return destination if source.stat().st_mtime > destination.stat().st_mtime else None
+        if self.policy == 'checksum':
+            return None if self._same_content(source, destination) else destination
+        user_input = input(f'{destination.name} already exists in this directory. Replace? (y/n): ')
+        while user_input.lower() not in ['y', 'n']:
+            user_input = input('Invalid input. Please enter "y" or "n": ')
+        return destination if user_input.lower() == 'y' else None
+
+    @staticmethod
+    def _free_name(destination):
+        """Returns the first 'name (n).ext' path next to the destination that does not exist yet."""
+        counter = 1
+        while True:
+            candidate = destination.with_name(f'{destination.stem} ({counter}){destination.suffix}')
+            if not candidate.exists():
+                return candidate
+            counter += 1
+
+    def _same_content(self, first, second):
+        """Compares two files by size first and by their SHA-256 digests only if the sizes match."""
+        if first.is_dir() or second.is_dir() or first.stat().st_size != second.stat().st_size:
+            return False
+        return self._digest(first) == self._digest(second)
+
+    def _digest(self, path):
+        """Returns the SHA-256 digest of a file, read in chunks to keep memory use flat."""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            while chunk := file.read(self.HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        return digest.digest()
+
+
+"""Defines a class that collects the outcome of a bulk copy or move operation."""
+
+
+class TransferReport:
+    def __init__(self, action):
+        self.action = action  # The action performed, either 'cp' or 'mv'.
+        self.files = 0  # Number of files transferred successfully.
+        self.bytes = 0  # Total size in bytes of the transferred files.
+        self.errors = []  # List of (file name, error message) tuples for the failed transfers.
+        self.cancelled = 0  # Number of files left untouched because the job was cancelled.
+        self.elapsed = 0.0  # Wall time of the whole batch in seconds.
+
+    def summary(self):
+        """Returns the number of transferred files with throughput figures, followed by one line per error."""
+        verb = 'moved' if self.action == 'mv' else 'copied'
+        elapsed = max(self.elapsed, 1e-9)  # Guards against a zero division on very fast batches.
+        lines = [f'{self.files} {"file" if self.files == 1 else "files"} {verb} in {self.elapsed:.2f}s '
+                 f'({self.files / elapsed:.1f} files/s, {self.bytes / elapsed / 1024 ** 2:.2f} MB/s)']
+        for name, message in self.errors:
+            lines.append(f'Error {"moving" if self.action == "mv" else "copying"} {name}: {message}')
+        if self.cancelled:
+            lines.append(f'Cancelled, {self.cancelled} {"file was" if self.cancelled == 1 else "files were"} skipped')
+        return ErrorMessage('\n'.join(lines)) if self.errors else '\n'.join(lines)
+
+
+"""Defines the base class of the engines that run file operations on a thread pool, cancellable by a job."""
+
+
+class PoolEngine:
+    def __init__(self, workers=None, cancel_event=None):
+        self.workers = workers or None  # Number of worker threads, None for the default of ThreadPoolExecutor.
+        self.cancel_event = cancel_event  # Optional callable returning the cancel event of the calling job, or None.
+        self.errors = Errors().errors  # Used to translate OS errors into readable messages.
+
+    def _job_cancel_event(self):
+        """Returns the cancel event of the job calling the engine, None outside of background jobs."""
+        return self.cancel_event() if self.cancel_event else None
+
+    def _error_message(self, error):
+        """Translates an OS error into a readable message."""
+        return self.errors['os_errors'].get(type(error), str(error))
+
+
+"""Defines a class that copies or moves batches of files concurrently on a thread pool."""
+
+
+class TransferEngine(PoolEngine):
+    def __init__(self, workers=None, copy_function=shutil.copy2, cancel_event=None):
+        super().__init__(workers, cancel_event)
+        self.copy_function = copy_function  # Function used to copy a single file, also when moving across devices.
+
+    def __call__(self, transfers, action, journal=None):
+        """Transfers every (source, destination) pair and returns a TransferReport.
+
+        A failing file does not abort the batch, its error is recorded in the report instead.
+        If a JournalBatch is given, the position of every completed transfer is recorded in it.
+        """
+        report = TransferReport(action)
+        cancel = self._job_cancel_event()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self._transfer, source, destination, action, cancel): (index, source)
+                       for index, (source, destination) in enumerate(transfers)}
+            for future in as_completed(futures):
+                index, source = futures[future]
+                try:
+                    size = future.result()
+                    if size is None:
+                        report.cancelled += 1
+                    else:
+                        report.bytes += size
+                        report.files += 1
+                        if journal is not None:
+                            journal.done(index)
+                except OSError as e:
+                    report.errors.append((source.name, self._error_message(e)))
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _transfer(self, source, destination, action, cancel=None):
+        """Copies or moves a single file and returns its size in bytes, or None if the job was cancelled."""
+        if cancel is not None and cancel.is_set():
+            return None
+        size = source.stat().st_size
+        if action == 'cp':
+            self.copy_function(source, destination)
+        elif action == 'mv':
+            shutil.move(source, destination, copy_function=self.copy_function)
+        return size
+
+
+"""Defines a class holding the sorted contents of a directory as of one scan."""
+
+
+class DirectoryListing:
+    def __init__(self, path, signature, dirs, files):
+        self.path = path  # The listed directory.
+        self.signature = signature  # The (mtime, inode) pair of the directory at the time of the scan.
+        self.dirs = dirs  # Sorted names of the subdirectories.
+        self.files = files  # Sorted names of the other entries.
+        self.rendered = None  # The lines of a plain ls, formatted on first use.
+
+    def sizes(self):
+        """Returns the current sizes of the files.
+
+        Writing to a file does not change the mtime of its directory, so sizes are read again on every call.
+        """
+        return [os.stat(os.path.join(self.path, name)).st_size for name in self.files]
+
+
+"""Defines a bounded LRU cache of directory listings that are rescanned only when a directory changes."""
+
+
+class ListingCache:
+    def __init__(self, max_dirs=64):
+        self.max_dirs = max_dirs  # Number of directories kept before the least recently listed one is evicted.
+        self._listings = OrderedDict()  # Maps a directory path to its DirectoryListing, oldest first.
+        self._lock = threading.Lock()  # Background jobs invalidate listings while the shell reads them.
+
+    def get(self, path):
+        """Returns the DirectoryListing of a directory, rescanning it only if its mtime or inode changed.
+
+        Changes made through the file manager are also caught by invalidate(), even within one mtime tick.
+        """
+        path = str(path)
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_ino)
+        with self._lock:
+            listing = self._listings.get(path)
+        if listing is None or listing.signature != signature:
+            listing = self._scan(path, signature)
+        with self._lock:
+            self._listings[path] = listing
+            self._listings.move_to_end(path)
+            while len(self._listings) > self.max_dirs:
+                self._listings.popitem(last=False)
+        return listing
+
+    @staticmethod
+    def _scan(path, signature):
+        """Reads the entries of a directory with a single scandir pass."""
+        dirs, files = [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                else:
+                    files.append(entry.name)
+        dirs.sort()
+        files.sort()
+        return DirectoryListing(path, signature, dirs, files)
+
+    def invalidate(self, *paths):
+        """Drops the cached listings of the given directories."""
+        with self._lock:
+            for path in paths:
+                self._listings.pop(str(path), None)
+
+    def invalidate_tree(self, path):
+        """Drops the cached listings of a directory and of everything below it."""
+        prefix = os.path.join(str(path), '')
+        with self._lock:
+            for cached in [cached for cached in self._listings if cached == str(path) or cached.startswith(prefix)]:
+                del self._listings[cached]
+
+
+"""Defines a class holding the result of scanning a single directory of a tree."""
+
+
+class DirectoryScan:
+    def __init__(self, path, signature, files, subdirs, error=None):
+        self.path = path  # The scanned directory.
+        self.signature = signature  # The (mtime, inode) pair of the directory at the time of the scan.
+        self.files = files  # List of (name, size, mtime) tuples, None when the scan was reused from a cache.
+        self.subdirs = subdirs  # Names of the subdirectories, symbolic links to directories are not followed.
+        self.size = sum(size for _, size, _ in files) if files else 0  # Total size of the files in bytes.
+        self.error = error  # Error message if the directory could not be read.
+
+
+"""Defines a class that collects the outcome of a bulk removal."""
+
+
+class RemovalReport:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run  # True if nothing was actually removed.
+        self.files = 0  # Number of files removed, or that would be removed.
+        self.dirs = 0  # Number of directories removed, or that would be removed.
+        self.bytes = 0  # Total size in bytes of the removed files.
+        self.errors = []  # List of (path, error message) tuples for the entries that could not be removed.
+        self.cancelled = 0  # Number of files left in place because the job was cancelled.
+        self.elapsed = 0.0  # Wall time of the whole removal in seconds.
+
+    def summary(self):
+        """Returns the number of removed entries with the freed size and throughput, followed by one line per error."""
+        files = f'{self.files} {"file" if self.files == 1 else "files"}'
+        dirs = f' and {self.dirs} {"directory" if self.dirs == 1 else "directories"}' if self.dirs else ''
+        if self.dry_run:
+            return f'{files}{dirs} would be removed ({FileManager._human_readable_size(self.bytes)})'
+        elapsed = max(self.elapsed, 1e-9)  # Guards against a zero division on very fast removals.
+        lines = [f'{files}{dirs} removed in {self.elapsed:.2f}s ({self.files / elapsed:.1f} files/s, '
+                 f'{FileManager._human_readable_size(self.bytes)} freed)']
+        lines.extend(f'Error removing {path}: {message}' for path, message in self.errors)
+        if self.cancelled:
+            lines.append(f'Cancelled, {self.cancelled} {"file was" if self.cancelled == 1 else "files were"} kept')
+        return ErrorMessage('\n'.join(lines)) if self.errors else '\n'.join(lines)
+
+
+"""Defines a class that removes large numbers of files concurrently on a thread pool."""
+
+
+class RemovalEngine(PoolEngine):
+    CHUNK_SIZE = 256  # Number of files unlinked by a single task, keeps the number of futures low.
+    PROGRESS_STEP = 1000  # The progress callback is called every time this many more files are done.
+
+    def __init__(self, workers=None, progress=None, cancel_event=None):
+        super().__init__(workers, cancel_event)
+        self.progress = progress  # Optional callable receiving (label, removed files, total files).
+
+    def __call__(self, files, dirs=(), dry_run=False, journal=None):
+        """Removes the files, given as (path, size) tuples, then the directories, and returns a RemovalReport.
+
+        The directories must be listed parents first, they are removed in reverse order once emptied.
+        A failing entry does not abort the removal, its error is recorded in the report instead.
+        If a JournalBatch is given, the position of every removed file is recorded in it.
+        """
+        report = RemovalReport(dry_run)
+        if dry_run:
+            report.files, report.dirs, report.bytes = len(files), len(dirs), sum(size for _, size in files)
+            return report
+        cancel = self._job_cancel_event()
+        start, done, reported = time.perf_counter(), 0, 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._unlink, files[i:i + self.CHUNK_SIZE], i, cancel)
+                       for i in range(0, len(files), self.CHUNK_SIZE)]
+            for future in as_completed(futures):
+                removed, freed, errors = future.result()
+                report.files += len(removed)
+                report.bytes += freed
+                report.errors.extend(errors)
+                if journal is not None:
+                    journal.done(*removed)
+                done += len(removed) + len(errors)
+                if self.progress and (done - reported >= self.PROGRESS_STEP or done == len(files)):
+                    self.progress('Removing', done, len(files))
+                    reported = done
+        report.cancelled = len(files) - done
+        for path in reversed(dirs):
+            if report.cancelled:
+                break  # Some files were kept, so their directories cannot be removed.
+            try:
+                os.rmdir(path)
+                report.dirs += 1
+            except OSError as e:
+                report.errors.append((path, self._error_message(e)))
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _unlink(self, chunk, start, cancel=None):
+        """Unlinks a chunk of files and returns the positions of the removed ones, the bytes freed and the errors.
+
+        The chunk starts at position start of the whole list and is abandoned as soon as the job is cancelled.
+        """
+        removed, freed, errors = [], 0, []
+        for index, (path, size) in enumerate(chunk, start):
+            if cancel is not None and cancel.is_set():
+                break
+            try:
+                os.unlink(path)
+                removed.append(index)
+                freed += size
+            except OSError as e:
+                errors.append((path, self._error_message(e)))
+        return removed, freed, errors
+
+
+"""Defines a class that matches relative file paths against glob and regex patterns compiled once and cached."""
+
+
+class PatternMatcher:
+    REGEX_PREFIX = 're:'  # Patterns starting with this prefix are regular expressions, the others are globs.
+
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self.regex = self._compile(self.patterns)  # Single regex matching any of the patterns.
+        # Patterns that can match below the current directory need a walk of the tree instead of one scandir.
+        self.recursive = any('/' in pattern or '**' in pattern for pattern in self.patterns)
+
+    def __call__(self, relative_path):
+        """Returns True if the path, relative to the searched directory and using '/' separators, matches."""
+        return self.regex.fullmatch(relative_path) is not None
+
+    @staticmethod
+    def is_pattern(text):
+        """Returns True if the argument is a pattern rather than the name of a single file or directory.
+
+        Besides globs and regexes this covers the extension shorthand, where '.log' means every '*.log' file.
+        """
+        return (text.startswith(PatternMatcher.REGEX_PREFIX) or any(char in text for char in '*?[')
+                or PatternMatcher.is_extension(text))
+
+    @staticmethod
+    def is_extension(text):
+        """Returns True if the argument uses the extension shorthand, such as '.log'."""
+        return text.startswith('.') and '/' not in text and text not in ('.', '..')
+
+    @staticmethod
+    @lru_cache(maxsize=256)
+    def _compile(patterns):
+        """Compiles a tuple of patterns into one alternation, repeated pattern sets are served from the cache."""
+        return re.compile('|'.join(f'(?:{PatternMatcher._translate(pattern)})' for pattern in patterns))
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def _translate(pattern):
+        """Translates a single pattern into regex source.
+
+        Regexes must match the whole relative path. In globs '*' and '?' do not cross directories,
+        '**' matches any number of directories and '[...]' is a character class, '[!...]' a negated one.
+        """
+        if pattern.startswith(PatternMatcher.REGEX_PREFIX):
+            return pattern[len(PatternMatcher.REGEX_PREFIX):]
+        if PatternMatcher.is_extension(pattern):
+            pattern = f'*{pattern}'
+        parts, i = [], 0
+        while i < len(pattern):
+            if pattern.startswith('**/', i):
+                parts.append('(?:.*/)?')
+                i += 3
+            elif pattern.startswith('**', i):
+                parts.append('.*')
+                i += 2
+            elif pattern[i] == '*':
+                parts.append('[^/]*')
+                i += 1
+            elif pattern[i] == '?':
+                parts.append('[^/]')
+                i += 1
+            elif pattern[i] == '[' and ']' in pattern[i + 2:]:
+                end = pattern.index(']', i + 2)
+                members = pattern[i + 1:end]
+                negated = members.startswith('!')
+                members = re.escape(members[1:] if negated else members).replace('\\-', '-')
+                parts.append(f'[{"^/" if negated else ""}{members}]')
+                i = end + 1
+            else:
+                parts.append(re.escape(pattern[i]))
+                i += 1
+        return ''.join(parts)
+
+
+"""Defines a class that walks a directory tree level by level, scanning the directories of a level in parallel."""
+
+
+class TreeWalker(PoolEngine):  # scandir and stat release the GIL, so the threads overlap the I/O waits.
+    def __call__(self, root, reuse=None):
+        """Yields a DirectoryScan for root and every directory below it, parents always before their children.
+
+        The optional reuse callable receives (path, signature) and may return a cached DirectoryScan of an unchanged
+        directory, in which case that directory is not read again.
+        Raises JobCancelledError between two levels once the calling job has been cancelled.
+        """
+        cancel = self._job_cancel_event()
+        level = [str(root)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while level:
+                if cancel is not None and cancel.is_set():
+                    raise JobCancelledError()
+                next_level = []
+                for scan in executor.map(lambda path: self._scan(path, reuse), level):
+                    yield scan
+                    next_level.extend(os.path.join(scan.path, name) for name in scan.subdirs)
+                level = next_level
+
+    def _scan(self, path, reuse):
+        """Reads a single directory, or takes it from the cache when its signature did not change."""
+        try:
+            stat = os.stat(path, follow_symlinks=False)
+            signature = (stat.st_mtime_ns, stat.st_ino)
+            cached = reuse(path, signature) if reuse else None
+            if cached is not None:
+                return cached
+            files, subdirs = [], []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.name)
+                    else:
+                        entry_stat = entry.stat(follow_symlinks=False)
+                        files.append((entry.name, entry_stat.st_size, entry_stat.st_mtime))
+            return DirectoryScan(path, signature, files, subdirs)
+        except OSError as e:
+            return DirectoryScan(path, None, [], [], self._error_message(e))
+
+
+"""Defines a cache of per-directory file sizes used to total up subtrees without reading unchanged directories."""
+
+
+class SubtreeSizeCache:
+    def __init__(self):
+        self._scans = {}  # Maps a directory path to its (signature, subdirectories, file names) tuple.
+        self._lock = threading.Lock()  # Background jobs update and invalidate the cache concurrently.
+
+    def __call__(self, path, signature):
+        """Returns a scan of an unchanged directory without reading it again, usable as TreeWalker's reuse.
+
+        Writing to a file does not change the mtime of its directory, so the cached files are stat-ed again for
+        their current sizes, which still saves the scandir. Returns None if the directory has to be read.
+        """
+        cached = self._scans.get(path)
+        if cached is None or cached[0] != signature:
+            return None
+        try:
+            size = sum(os.stat(os.path.join(path, name), follow_symlinks=False).st_size for name in cached[2])
+        except OSError:
+            return None
+        scan = DirectoryScan(path, signature, None, cached[1])
+        scan.size = size
+        return scan
+
+    def add(self, scan):
+        """Stores the subdirectories and file names of a successful scan."""
+        if scan.error is None and scan.files is not None:
+            with self._lock:
+                self._scans[scan.path] = (scan.signature, scan.subdirs, [name for name, _, _ in scan.files])
+
+    def clear(self):
+        """Drops every cached directory."""
+        with self._lock:
+            self._scans.clear()
+
+    def invalidate(self, *paths):
+        """Drops the cached sizes of the given directories."""
+        with self._lock:
+            for path in paths:
+                self._scans.pop(str(path), None)
+
+    def invalidate_tree(self, path):
+        """Drops the cached sizes of a directory and of everything below it."""
+        prefix = os.path.join(str(path), '')
+        with self._lock:
+            for cached in [cached for cached in self._scans if cached == str(path) or cached.startswith(prefix)]:
+                del self._scans[cached]
+
+
+def _file_digest(path, limit=None):
+    """Returns a (path, digest) tuple for the first limit bytes of a file, or for the whole file if limit is None.
+
+    Files of at least DuplicateFinder.MMAP_THRESHOLD bytes are memory-mapped instead of read into memory.
+    Defined at module level so that it can be sent to the worker processes, the digest is None if reading failed.
+    """
+    try:
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            length = size if limit is None else min(size, limit)
+            if length >= DuplicateFinder.MMAP_THRESHOLD:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                    digest = hashlib.blake2b(view[:length])
+            else:
+                digest = hashlib.blake2b(file.read(length))
+        return path, digest.hexdigest()
+    except OSError:
+        return path, None
+
+
+"""Defines a class that finds files with identical content below a directory."""
+
+
+class DuplicateFinder:
+    PARTIAL_SIZE = 64 * 1024  # Number of leading bytes hashed to split files of equal size cheaply.
+    MMAP_THRESHOLD = 4 * 1024 ** 2  # Files of at least this size are hashed through a memory map.
+
+    def __init__(self, walker, workers=None):
+        self.walker = walker  # TreeWalker used to list the files of the tree.
+        self.workers = workers  # Number of hashing processes, defaults to the number of CPUs.
+        # Background jobs run on threads, and forking a process with several threads can deadlock the child.
+        self.context = multiprocessing.get_context('spawn')
+
+    def __call__(self, root):
+        """Returns the groups of duplicate files below root as lists of paths, largest files first.
+
+        Files are grouped by size, then by the hash of their first PARTIAL_SIZE bytes, and only the remaining
+        candidates are hashed in full. Empty files and hard links to an already seen file are ignored.
+        """
+        by_size = {}
+        for scan in self.walker(root):
+            for name, size, _ in scan.files:
+                if size:
+                    by_size.setdefault(size, []).append(os.path.join(scan.path, name))
+        candidates = [self._distinct_inodes(paths) for paths in by_size.values() if len(paths) > 1]
+        candidates = [paths for paths in candidates if len(paths) > 1]
+        if not candidates:
+            return []
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=self.context) as executor:
+            candidates = self._split_by_digest(executor, candidates, self.PARTIAL_SIZE)
+            groups = self._split_by_digest(executor, candidates, None)
+        return sorted((sorted(group) for group in groups), key=lambda group: -os.path.getsize(group[0]))
+
+    @staticmethod
+    def _distinct_inodes(paths):
+        """Keeps a single path for every inode, so existing hard links are not reported as duplicates."""
+        inodes = {}
+        for path in paths:
+            try:
+                stat = os.stat(path, follow_symlinks=False)
+            except OSError:
+                continue
+            inodes.setdefault((stat.st_dev, stat.st_ino), path)
+        return list(inodes.values())
+
+    @staticmethod
+    def _split_by_digest(executor, groups, limit):
+        """Hashes every path of the groups in the process pool and splits the groups by digest."""
+        paths = [path for group in groups for path in group]
+        digests = dict(executor.map(_file_digest, paths, [limit] * len(paths), chunksize=max(1, len(paths) // 256)))
+        result = []
+        for group in groups:
+            by_digest = {}
+            for path in group:
+                if digests[path] is not None:
+                    by_digest.setdefault(digests[path], []).append(path)
+            result.extend(paths for paths in by_digest.values() if len(paths) > 1)
+        return result
+
+
+"""Defines an on-disk index of file names, sizes and modification times that is refreshed incrementally."""
+
+
+class FileIndex:
+    FLUSH_EVERY = 1000  # Number of changed directories written to the index per transaction.
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime_ns INTEGER, inode INTEGER, subdirs TEXT);
+        CREATE TABLE IF NOT EXISTS files (dir TEXT, name TEXT, ext TEXT, size INTEGER, mtime REAL);
+        CREATE INDEX IF NOT EXISTS files_dir ON files (dir);
+        CREATE INDEX IF NOT EXISTS files_name ON files (name);
+        CREATE INDEX IF NOT EXISTS files_ext ON files (ext);
+        CREATE INDEX IF NOT EXISTS files_size ON files (size);
+    """
+
+    def __init__(self, path, walker):
+        self.path = path  # Location of the SQLite database holding the index.
+        self.walker = walker  # TreeWalker used to refresh the index.
+        self._connection = None  # Opened on first use, so file managers that never search create no file.
+        self._lock = threading.Lock()  # The connection is shared by the shell and background jobs.
+        self._stale = set()  # Directories changed through the file manager since the last refresh.
+
+    def update(self, root, sizes=False):
+        """Brings the index of a tree up to date and returns the number of directories read and removed.
+
+        Only directories whose (mtime, inode) changed, or that the file manager changed, are read again.
+        Writing to a file does not change the mtime of its directory, so with sizes set the files of the other
+        directories are stat-ed as well, and a directory with a file whose size or mtime changed is read again.
+        """
+        root = str(root)
+        with self._lock:
+            rows = self._execute('SELECT path, mtime_ns, inode, subdirs FROM dirs WHERE ' + self._subtree_clause(),
+                                 *self._subtree(root))
+            known = {path: ((mtime_ns, inode), subdirs) for path, mtime_ns, inode, subdirs in rows}
+            stale = set(self._stale)
+            indexed = {}  # Maps a directory to the (name, size, mtime) tuples of its indexed files.
+            if sizes:
+                for directory, name, size, mtime in self._execute(
+                        'SELECT dir, name, size, mtime FROM files WHERE ' + self._subtree_clause('dir'),
+                        *self._subtree(root)):
+                    indexed.setdefault(directory, []).append((name, size, mtime))
+
+        def unchanged_files(path):
+            try:
+                for name, size, mtime in indexed.get(path, ()):
+                    stat = os.stat(os.path.join(path, name), follow_symlinks=False)
+                    if stat.st_size != size or stat.st_mtime != mtime:
+                        return False
+            except OSError:
+                return False
+            return True
+
+        def reuse(path, signature):
+            cached = known.get(path)
+            if cached is None or cached[0] != signature or path in stale or sizes and not unchanged_files(path):
+                return None
+            return DirectoryScan(path, signature, None, cached[1].split('\0') if cached[1] else [])
+
+        seen, changed, read = set(), [], 0
+        for scan in self.walker(root, reuse):
+            seen.add(scan.path)
+            if scan.files is not None and scan.error is None:
+                changed.append(scan)
+            if len(changed) >= self.FLUSH_EVERY:
+                read += self._write(changed)
+                changed = []
+        read += self._write(changed)
+        removed = [path for path in known if path not in seen]
+        with self._lock, self._connection:
+            self._stale -= seen
+            self._connection.executemany('DELETE FROM dirs WHERE path = ?', [(path,) for path in removed])
+            self._connection.executemany('DELETE FROM files WHERE dir = ?', [(path,) for path in removed])
+        return read, len(removed)
+
+    def search(self, root, name=None, ext=None, min_size=None, max_size=None, limit=None):
+        """Returns (path, size) tuples of the indexed files below root matching every given criterion.
+
+        The name is a case-sensitive glob matched against the file name, the extension includes the dot.
+        """
+        sql, params = 'SELECT dir, name, size FROM files WHERE ' + self._subtree_clause('dir'), self._subtree(root)
+        for clause, value in (('name GLOB ?', name), ('ext = ?', ext and ext.lower()),
+                              ('size >= ?', min_size), ('size <= ?', max_size)):
+            if value is not None:
+                sql += f' AND {clause}'
+                params.append(value)
+        sql += ' ORDER BY dir, name'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        with self._lock:
+            return [(os.path.join(directory, file), size) for directory, file, size in self._execute(sql, *params)]
+
+    def invalidate(self, *paths):
+        """Marks directories changed through the file manager, so the next refresh reads them again."""
+        with self._lock:
+            self._stale.update(str(path) for path in paths)
+
+    def _write(self, scans):
+        """Replaces the indexed entries of the given directories in a single transaction."""
+        if not scans:
+            return 0
+        with self._lock, self._connection:
+            self._connection.executemany('DELETE FROM files WHERE dir = ?', [(scan.path,) for scan in scans])
+            self._connection.executemany('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)', [
+                (scan.path, *scan.signature, '\0'.join(scan.subdirs)) for scan in scans])
+            self._connection.executemany('INSERT INTO files VALUES (?, ?, ?, ?, ?)', [
+                (scan.path, name, os.path.splitext(name)[1].lower(), size, mtime)
+                for scan in scans for name, size, mtime in scan.files])
+        return len(scans)
+
+    def _execute(self, sql, *params):
+        """Runs a query on the index, creating the database on first use, must be called with the lock held."""
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.executescript(self.SCHEMA)
+        return self._connection.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _subtree_clause(column='path'):
+        """Returns a condition selecting a directory and its descendants, using a range the indexes can serve."""
+        return f'({column} = ? OR ({column} >= ? AND {column} < ?))'
+
+    @staticmethod
+    def _subtree(root):
+        """Returns the parameters of _subtree_clause for a root directory."""
+        root = str(root).rstrip(os.sep) or os.sep
+        prefix = os.path.join(root, '')
+        return [root, prefix, prefix[:-1] + chr(ord(os.sep) + 1)]
+
+
+"""Defines a class recording the completed operations of one journaled batch."""
+
+
+class JournalBatch:
+    def __init__(self, journal, batch_id, indexes=None):
+        self.journal = journal  # The Journal the records are appended to.
+        self.id = batch_id  # Id of the batch in the journal.
+        self.indexes = indexes  # Maps positions reported by an engine to operation numbers, when resuming a batch.
+        self._pending = []  # Completed operations not written to the journal yet.
+        self._lock = threading.Lock()
+
+    def done(self, *positions):
+        """Records completed operations, writing and syncing them as one record every Journal.SYNC_EVERY of them."""
+        with self._lock:
+            self._pending.extend(self.indexes[position] if self.indexes else position for position in positions)
+            if len(self._pending) < self.journal.SYNC_EVERY:
+                return
+            pending, self._pending = self._pending, []
+        self.journal.append({'batch': self.id, 'type': 'done', 'ops': pending})
+
+    def flush(self):
+        """Writes and syncs the completed operations recorded so far."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            self.journal.append({'batch': self.id, 'type': 'done', 'ops': pending})
+
+    def close(self, state='commit'):
+        """Flushes the batch and ends it, a committed or rolled back batch can no longer be resumed."""
+        self.flush()
+        self.journal.append({'batch': self.id, 'type': state})
+
+
+"""Defines an append-only journal of bulk cp, mv and rm batches, used to resume or roll back interrupted ones."""
+
+
+class Journal:
+    SYNC_EVERY = 1000  # Number of completed operations grouped into one record and one fsync.
+
+    def __init__(self, path):
+        self.path = Path(path)  # Location of the journal, one JSON record per line.
+        self._lock = threading.Lock()  # Background jobs append to the journal concurrently.
+
+    def begin(self, action, directory, ops, dirs=()):
+        """Writes the intent record of a new batch before any of its operations runs and returns its JournalBatch.
+
+        For cp and mv an operation is a [source, destination] pair, for rm a [path, size] pair, with the
+        directories of a removed tree listed parents first in dirs. The journal is truncated once every
+        batch in it has ended, so it only grows with the batches that still need attention.
+        """
+        with self._lock:
+            batches = self._read()
+            if batches and all(batch['state'] for batch in batches.values()):
+                self.path.unlink()
+                batches = {}
+            batch_id = max(batches, default=0) + 1
+            # Written under the same lock, so that a concurrent batch cannot be given the same id.
+            self._write({'batch': batch_id, 'type': 'begin', 'action': action, 'cwd': str(directory),
+                         'ops': ops, 'dirs': list(dirs)})
+        return JournalBatch(self, batch_id)
+
+    def incomplete(self):
+        """Returns a dictionary of the batches that were neither committed nor rolled back, by batch id."""
+        with self._lock:
+            return {batch_id: batch for batch_id, batch in self._read().items() if not batch['state']}
+
+    def append(self, record):
+        """Appends a record and syncs it to disk before returning."""
+        with self._lock:
+            self._write(record)
+
+    def _write(self, record):
+        """Appends a record and syncs it, must be called with the lock held."""
+        line = json.dumps(record) + '\n'
+        with open(self.path, 'a') as journal:
+            journal.write(line)
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def _read(self):
+        """Replays the journal into a dictionary of batches, each with its operations, completed set and state.
+
+        A truncated last line, left by a crash in the middle of a write, is ignored.
+        """
+        batches = {}
+        if not self.path.exists():
+            return batches
+        with open(self.path) as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record['type'] == 'begin':
+                    batches[record['batch']] = dict(record, done=set(), state=None)
+                elif record['batch'] in batches:
+                    if record['type'] == 'done':
+                        batches[record['batch']]['done'].update(record['ops'])
+                    else:
+                        batches[record['batch']]['state'] = record['type']
+        return batches
+
+
+"""Defines a class representing a command that runs, or waits to run, in the background."""
+
+
+class Job:
+    def __init__(self, job_id, line, directory, device):
+        self.id = job_id  # Number identifying the job in jobs, wait and cancel.
+        self.line = line  # The command line the job executes.
+        self.directory = directory  # The current directory at the time the job was submitted.
+        self.device = device  # Device of the filesystem the job writes to, used for the concurrency limit.
+        self.state = 'queued'  # One of queued, running, done, failed or cancelled.
+        self.result = None  # The output of the command once the job has finished.
+        self.cancel = threading.Event()  # Set to ask a running job to stop at the next file or directory.
+        self.finished = threading.Event()  # Set once the job has left the running state.
+        self.started_at = None  # perf_counter value when the job started running.
+        self.finished_at = None  # perf_counter value when the job finished.
+        self.reported = False  # True once the output of the finished job has been shown.
+
+    def elapsed(self):
+        """Returns the number of seconds the job has been running, or ran for."""
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+
+"""Defines a class that runs jobs on background threads, with a limit of concurrent jobs per filesystem."""
+
+
+class JobScheduler:
+    def __init__(self, runner, per_device=2):
+        self.runner = runner  # Callable executing a Job and returning its output.
+        self.per_device = per_device  # Number of jobs allowed to run at once on the same filesystem.
+        self.jobs = {}  # Maps job ids to every Job submitted so far.
+        self._queues = {}  # Maps a device to the deque of its jobs waiting for a free slot.
+        self._running = {}  # Maps a device to the number of its running jobs.
+        self._finished = []  # Jobs finished since the last call to finished().
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def submit(self, line, directory, device):
+        """Queues a command line and starts it right away if its filesystem has a free slot."""
+        with self._lock:
+            job = Job(self._next_id, line, directory, device)
+            self._next_id += 1
+            self.jobs[job.id] = job
+            self._queues.setdefault(device, deque()).append(job)
+            self._start_queued(device)
+        return job
+
+    def cancel(self, job_id):
+        """Cancels a job, a queued job is dropped and a running one stops at the next file or directory.
+
+        A job that has already finished is returned unchanged.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state in ('done', 'failed', 'cancelled'):
+                return job
+            job.cancel.set()
+            if job.state == 'queued':
+                self._queues[job.device].remove(job)
+                job.state = 'cancelled'
+                self._finished.append(job)
+                job.finished.set()
+        return job
+
+    def wait(self, job_id=None):
+        """Blocks until the given job, or every job, has finished and returns the awaited jobs."""
+        jobs = [self.jobs[job_id]] if job_id is not None else list(self.jobs.values())
+        for job in jobs:
+            job.finished.wait()
+        return jobs
+
+    def finished(self):
+        """Returns the jobs that finished since the previous call and have not been reported by wait yet."""
+        with self._lock:
+            finished, self._finished = self._finished, []
+        return [job for job in finished if not job.reported]
+
+    def _start_queued(self, device):
+        """Starts queued jobs of a device while it has free slots, must be called with the lock held."""
+        queue = self._queues[device]
+        while queue and self._running.get(device, 0) < self.per_device:
+            job = queue.popleft()
+            self._running[device] = self._running.get(device, 0) + 1
+            job.state = 'running'
+            job.started_at = time.perf_counter()
+            threading.Thread(target=self._run, args=(job,), daemon=True).start()
+
+    def _run(self, job):
+        """Runs a job on its own thread and starts the next queued job of the same filesystem afterwards."""
+        try:
+            job.result = self.runner(job)
+            if job.cancel.is_set():
+                job.state = 'cancelled'
+            else:
+                job.state = 'failed' if isinstance(job.result, ErrorMessage) else 'done'
+        except JobCancelledError:
+            job.state = 'cancelled'
+        except Exception as e:
+            job.result = ErrorMessage(f'Error running the job: {e}')
+            job.state = 'failed'
+        finally:
+            job.finished_at = time.perf_counter()
+            with self._lock:
+                self._running[job.device] -= 1
+                self._finished.append(job)
+                self._start_queued(job.device)
+            job.finished.set()
+
+
 """Defines a class for a simple file manager that supports basic file and directory operations."""
 
 
 class FileManager:
-    def __init__(self):
-        """Initializes the file manager with the current directory and available commands."""
+    INDEX_PATH = Path.home() / '.file_manager_index.sqlite'  # Default location of the index used by find.
+    JOURNAL_PATH = Path.home() / '.file_manager_journal.jsonl'  # Default location of the batch journal.
+
+    def __init__(self, workers=None, conflict='ask', jobs_per_device=2, index_path=None, journal=False,
+                 journal_path=None, stats=False):
+        """Initializes the file manager with the current directory and available commands.
+
+        The workers argument sets the number of threads used by extension-wide cp and mv, the conflict argument
+        sets the default ConflictPolicy of cp and mv, which a single command can override with --conflict=<policy>.
+        The jobs_per_device argument limits how many background jobs may write to the same filesystem at once,
+        and index_path sets where the index of find is stored. With journal set every bulk cp, mv and rm is
+        journaled, otherwise only those given --journal, and journal_path sets where the journal is stored.
+        With stats set every command is measured from the start, otherwise once 'stats on' is run.
+        """
+        self._job_context = threading.local()  # Holds the job and working directory of a background job thread.
         self._current_dir = Path.cwd()  # Sets the initial directory to the current working directory.
         """Dictionary mapping command names to Command objects, specifying the function, argument count,
         and multi-argument support."""
         self._commands = {
             'pwd': Command(self._pwd, 0, False),
             'cd': Command(self._cd, 1, False),
-            'cp': Command(self._cp, 2, False),
+            'cp': Command(self._cp, 2, False, True),
             'ls': Command(self._ls, 0, True),
-            'rm': Command(self._rm, 1, False),
-            'mv': Command(self._mv, 2, False),
+            'rm': Command(self._rm, 1, False, True),
+            'mv': Command(self._mv, 2, False, True),
             'mkdir': Command(self._mkdir, 1, False),
+            'du': Command(self._du, 0, True, True),
+            'dedupe': Command(self._dedupe, 0, True, True),
+            'find': Command(self._find, 0, True, True),
+            'journal': Command(self._journal_list, 0, False),
+            'resume': Command(self._resume, 0, True, True),
+            'rollback': Command(self._rollback, 0, True, True),
+            'stats': Command(self._stats_command, 0, True),
+            'jobs': Command(self._jobs_list, 0, False),
+            'wait': Command(self._wait, 0, True),
+            'cancel': Command(self._cancel, 1, False),
             'quit': Command(self._quit, 0, False)
         }
         self.errors = Errors().errors  # Creates an instance of the Errors class for error handling.
+        self._conflict = ConflictPolicy(conflict)  # Default policy applied to existing destinations.
+        self._copy_file = FileCopier(progress=self._show_progress)  # Copies single files, large ones by the kernel.
+        # Runs the bulk transfers of extension-wide cp and mv.
+        self._transfer = TransferEngine(workers, self._copy_file, self._cancel_event)
+        self._listings = ListingCache()  # Keeps recent ls results until the directories change.
+        self._walker = TreeWalker(workers, self._cancel_event)  # Walks directory trees for du, dedupe and rm.
+        self._removal = RemovalEngine(workers, self._show_progress, self._cancel_event)  # Runs the bulk removals of rm.
+        self._subtree_sizes = SubtreeSizeCache()  # Keeps the file sizes of every directory du has walked.
+        self._duplicates = DuplicateFinder(self._walker)  # Finds files with identical content for dedupe.
+        self._index = FileIndex(index_path or self.INDEX_PATH, self._walker)  # Answers the queries of find.
+        self._journal = Journal(journal_path or self.JOURNAL_PATH)  # Records the batches of journaled commands.
+        self._journal_default = journal  # True if bulk commands are journaled without --journal.
+        self._stats = CommandStats()  # Latency and I/O totals of the measured commands.
+        self._set_stats(stats)
+        self._jobs = JobScheduler(self._run_job, jobs_per_device)  # Runs the commands ending with '&'.
+
+    @property
+    def _current_dir(self):
+        """The current directory, background jobs keep the one that was current when they were submitted."""
+        return getattr(self._job_context, 'current_dir', None) or self._shell_dir
+
+    @_current_dir.setter
+    def _current_dir(self, value):
+        self._shell_dir = value
+
+    def _set_stats(self, enabled):
+        """Turns the measurement of every command, except stats itself, on or off."""
+        for name, command in self._commands.items():
+            command.recorder = partial(self._stats.measure, name) if enabled and name != 'stats' else None
+
+    def _stats_command(self, *parameters):
+        """Method to show or control the command measurements.
+
+        Without parameters it shows the totals as a table. 'on', 'off' and 'reset' control the measurement,
+        and '--json' shows the totals as JSON, or writes them to a file with '--json=<file>'.
+        """
+        if not parameters:
+            return self._stats.table() if self._stats.commands else 'No commands measured, use "stats on".'
+        if len(parameters) > 1:
+            return self.errors['os_errors'].get('InvalidParameterError')
+        parameter = parameters[0]
+        if parameter in ('on', 'off'):
+            self._set_stats(parameter == 'on')
+            return f'Command statistics {"enabled" if parameter == "on" else "disabled"}.'
+        if parameter == 'reset':
+            self._stats.reset()
+            return 'Command statistics reset.'
+        if parameter == '--json':
+            return self._stats.to_json()
+        if parameter.startswith('--json='):
+            path = self._current_dir / parameter.partition('=')[2]
+            path.write_text(self._stats.to_json())
+            return f'Command statistics written to {path}.'
+        return self.errors['os_errors'].get('InvalidParameterError')
 
     def _pwd(self):
         """Method to return the current working directory."""
         return self._current_dir
 
-    def _cp(self, file, new_file):
-        """Copy a file or all files with a given extension to a new location."""
-        if file.startswith('.'):
-            return self._copy_files_with_extension(file, new_file)
-        else:
-            return self._move_copy_file(file, new_file, 'cp')
+    def _cp(self, *args):
+        """Copy a file, or all files matching extensions, globs or regexes, to a new location."""
+        return self._copy_or_move(args, 'cp')
 
-    def _mv(self, file_name, new_path):
-        """Move a file or all files with a given extension to a new location."""
-        if file_name.startswith('.'):
-            return self._move_files_with_extension(file_name, new_path)
-        else:
-            return self._move_copy_file(file_name, new_path, 'mv')
+    def _mv(self, *args):
+        """Move a file, or all files matching extensions, globs or regexes, to a new location."""
+        return self._copy_or_move(args, 'mv')
+
+    def _copy_or_move(self, args, action):
+        """Parses 'SOURCE... TARGET [--conflict=<policy>]' and copies or moves the sources.
 
-    def _move_copy_file(self, file, new_file, action):
+        A single source that is not a pattern is a file or directory name, otherwise every source is a pattern
+        and all matching files are found in one pass, then transferred in one batch, journaled with --journal.
+        """
+        options = [arg for arg in args if arg.startswith('--') and arg != '--journal']
+        paths = [arg for arg in args if not arg.startswith('--')]
+        if len(paths) < 2:
+            return self.errors['wrong_arguments'].get(action)
+        conflict = self._conflict_policy(options)
+        if conflict is None:
+            return self.errors['os_errors'].get('InvalidConflictPolicyError')
+        journal = self._journal_default or '--journal' in args
+        *sources, target = paths
+        if len(sources) == 1 and not self._is_pattern(sources[0]):
+            return self._move_copy_file(sources[0], target, action, conflict)
+        try:
+            report = self._process_matching_files(sources, target, action, conflict, journal)
+        except re.error:
+            return self.errors['os_errors'].get('InvalidPatternError')
+        if not report:
+            return self._no_match_error(sources)
+        return report.summary()
+
+    def _conflict_policy(self, options):
+        """Returns the ConflictPolicy selected by a --conflict=<policy> option, the default one, or None if invalid.
+
+        Background jobs cannot prompt, so they skip existing destinations instead of asking.
+        """
+        conflict = self._conflict
+        for option in options:
+            name, _, value = option.partition('=')
+            if name != '--conflict' or value not in ConflictPolicy.POLICIES:
+                return None
+            conflict = ConflictPolicy(value)
+        if conflict.policy == 'ask' and self._cancel_event() is not None:
+            return ConflictPolicy('skip')
+        return conflict
+
+    def _move_copy_file(self, file, new_file, action, conflict):
         local_file = self._current_dir / file
         dest_file = Path(new_file) if Path(new_file).is_absolute() else self._current_dir / new_file
         if dest_file.is_dir():
             dest_file = dest_file / file
         if dest_file.exists():
-            if action == 'mv':
-                return 'The file or directory already exists'
-            elif action == 'cp':
-                user_input = input(f'{file} already exists in this directory. Replace? (y/n): ')
-                if user_input.lower() != 'y':
-                    return
+            if action == 'mv' and conflict.policy == 'ask':
+                return ErrorMessage('The file or directory already exists')
+            dest_file = conflict(local_file, dest_file)
+            if dest_file is None:
+                return
         try:
             if action == 'mv':
-                shutil.move(local_file, dest_file)
+                shutil.move(local_file, dest_file, copy_function=self._copy_file)
+                self._invalidate_tree(local_file)
             elif action == 'cp':
-                shutil.copy2(local_file, dest_file)
+                self._copy_file(local_file, dest_file)
         except FileNotFoundError as e:
             return self.errors['os_errors'].get(type(e))
+        finally:
+            self._invalidate(local_file.parent, dest_file.parent)
         return f'{file} {"moved" if action == "mv" else "copied"} successfully.'
 
-    def _copy_files_with_extension(self, extension, target_dir):
-        files_copied = self._process_files_with_extension(extension, target_dir, 'cp')
-        if not files_copied:
-            return f"File extension {extension} not found in this directory."
+    def _is_pattern(self, text):
+        """Returns True if an argument is a pattern, see PatternMatcher.is_pattern().
 
-    def _move_files_with_extension(self, extension, target_dir):
-        files_moved = self._process_files_with_extension(extension, target_dir, 'mv')
-        if not files_moved:
-            return f"File extension {extension} not found in this directory."
+        As in shells, a glob or regex that is the name of an existing file or directory is taken as that name.
+        The extension shorthand stays a pattern, as it always was.
+        """
+        if PatternMatcher.is_extension(text):
+            return True
+        return PatternMatcher.is_pattern(text) and not os.path.lexists(self._current_dir / text)
 
-    def _process_files_with_extension(self, extension, target_dir, action):
-        files = list(self._current_dir.glob(f'*{extension}'))
-        if not files:
-            return False
-        for file in files:
-            new_file_path = Path(target_dir) / file.name
-            if new_file_path.exists():
-                user_input = input(f'{file.name} already exists in this directory. Replace? (y/n): ')
-                while user_input.lower() not in ['y', 'n']:
-                    user_input = input('Invalid input. Please enter "y" or "n": ')
-                if user_input.lower() == 'n':
-                    continue
-            if action == 'cp':
-                shutil.copy2(file, new_file_path)
-            elif action == 'mv':
-                shutil.move(file, new_file_path)
-        return True
+    @staticmethod
+    def _no_match_error(patterns):
+        """Returns the error for patterns that matched nothing, worded as before for a single extension."""
+        if len(patterns) == 1 and PatternMatcher.is_extension(patterns[0]):
+            return ErrorMessage(f"File extension {patterns[0]} not found in this directory.")
+        return ErrorMessage(f"No files match {' '.join(patterns)} in this directory.")
+
+    def _match_files(self, patterns):
+        """Yields (path, relative path, size) for every file matching any of the patterns in a single pass.
+
+        Patterns containing '/' or '**' are matched against the whole tree below the current directory,
+        the others against the current directory only. A pattern that is the name of an existing file matches it.
+        """
+        patterns = [pattern if self._is_pattern(pattern) else PatternMatcher.REGEX_PREFIX + re.escape(pattern)
+                    for pattern in patterns]
+        matcher = PatternMatcher(patterns)
+        if not matcher.recursive:
+            with os.scandir(self._current_dir) as entries:
+                for entry in entries:
+                    if not entry.is_dir() and matcher(entry.name):
+                        yield Path(entry.path), entry.name, entry.stat().st_size
+            return
+        root = str(self._current_dir)
+        for scan in self._walker(root):
+            relative_dir = os.path.relpath(scan.path, root).replace(os.sep, '/')
+            for name, size, _ in scan.files:
+                relative = name if relative_dir == '.' else f'{relative_dir}/{name}'
+                if matcher(relative):
+                    yield Path(scan.path, name), relative, size
+
+    def _process_matching_files(self, patterns, target_dir, action, conflict, journal=False):
+        """Resolves the conflicts for every matching file, then hands the batch to the transfer engine.
+
+        Files found below the current directory keep their relative path inside the target directory.
+        """
+        target = self._current_dir / target_dir
+        transfers, created, matched = [], set(), False
+        for file, relative, _ in self._match_files(patterns):
+            matched = True
+            destination = target / relative
+            if destination.parent != target and destination.parent not in created:
+                destination.parent.mkdir(parents=True, exist_ok=True)
+                created.add(destination.parent)
+            new_file_path = conflict(file, destination)
+            if new_file_path is not None:
+                transfers.append((file, new_file_path))
+        if not matched:
+            return None
+        try:
+            ops = [[str(source), str(destination)] for source, destination in transfers]
+            return self._run_batch(journal, action, ops, lambda batch: self._transfer(transfers, action, batch))
+        finally:
+            self._invalidate(self._current_dir, *{path.parent for transfer in transfers for path in transfer})
+
+    def _run_batch(self, journal, action, ops, run, dirs=()):
+        """Runs a bulk operation through run(batch), journaling it first if asked to.
+
+        The batch is committed only if every operation succeeded, otherwise it stays open for resume or rollback.
+        """
+        batch = self._journal.begin(action, self._current_dir, ops, dirs) if journal else None
+        report = run(batch)
+        if batch is not None:
+            if report.errors or report.cancelled:
+                batch.flush()
+            else:
+                batch.close()
+        return report
+
+    def _journal_list(self):
+        """Method to list the journaled batches that were interrupted or had errors."""
+        batches = self._journal.incomplete()
+        if not batches:
+            return 'No incomplete batches.'
+        return '\n'.join(f'[{batch_id}] {batch["action"]} {len(batch["done"])}/{len(batch["ops"])} done  '
+                         f'{batch["cwd"]}' for batch_id, batch in batches.items())
+
+    def _pick_batch(self, batch_ids):
+        """Returns the (id, batch) of the given incomplete batch, or of the latest one, or None."""
+        batches = self._journal.incomplete()
+        if len(batch_ids) > 1 or (batch_ids and not batch_ids[0].isdigit()):
+            return None
+        batch_id = int(batch_ids[0]) if batch_ids else max(batches, default=None)
+        return (batch_id, batches[batch_id]) if batch_id in batches else None
+
+    def _resume(self, *batch_ids):
+        """Method to finish the remaining operations of an incomplete journaled batch, the latest by default.
+
+        Operations whose effect is already visible on disk, such as a moved file, count as done.
+        """
+        picked = self._pick_batch(batch_ids)
+        if picked is None:
+            return self.errors['os_errors'].get('InvalidBatchError')
+        batch_id, batch = picked
+        pending, finished = [], []
+        for index, (source, _) in enumerate(batch['ops']):
+            if index in batch['done']:
+                continue
+            if batch['action'] in ('rm', 'mv') and not os.path.lexists(source):
+                finished.append(index)  # The file was removed or moved before the batch was interrupted.
+            else:
+                pending.append(index)
+        JournalBatch(self._journal, batch_id).done(*finished)
+        journal = JournalBatch(self._journal, batch_id, pending)
+        ops = [batch['ops'][index] for index in pending]
+        if batch['action'] == 'rm':
+            dirs = [path for path in batch['dirs'] if os.path.isdir(path)]
+            report = self._removal([tuple(op) for op in ops], dirs, journal=journal)
+        else:
+            report = self._transfer([(Path(source), Path(destination)) for source, destination in ops],
+                                    batch['action'], journal)
+        if report.errors or report.cancelled:
+            journal.flush()
+        else:
+            journal.close()
+        self._invalidate_tree(batch['cwd'])
+        return report.summary()
+
+    def _rollback(self, *batch_ids):
+        """Method to undo the completed operations of an incomplete journaled batch, the latest by default.
+
+        Moved files are moved back and copies are removed, removed files cannot be restored.
+        """
+        picked = self._pick_batch(batch_ids)
+        if picked is None:
+            return self.errors['os_errors'].get('InvalidBatchError')
+        batch_id, batch = picked
+        if batch['action'] == 'rm':
+            return ErrorMessage('Removed files cannot be restored, use resume to finish the batch instead.')
+        if batch['action'] == 'mv':
+            undo = [(Path(destination), Path(source)) for source, destination in batch['ops']
+                    if os.path.lexists(destination) and not os.path.lexists(source)]
+            report = self._transfer(undo, 'mv')
+        else:
+            undo = [(destination, os.lstat(destination).st_size)
+                    for index, (_, destination) in enumerate(batch['ops'])
+                    if index in batch['done'] and os.path.lexists(destination)]
+            report = self._removal(undo)
+        if not report.errors and not report.cancelled:
+            JournalBatch(self._journal, batch_id).close('rollback')
+        self._invalidate_tree(batch['cwd'])
+        return report.summary()
+
+    @staticmethod
+    def _show_progress(name, copied, total):
+        """Shows the progress of a large file transfer on a single terminal line."""
+        if not sys.stderr.isatty():
+            return
+        sys.stderr.write(f'\r{name}: {copied * 100 // total}%')
+        if copied >= total:
+            sys.stderr.write('\n')
+        sys.stderr.flush()
 
     def _cd(self, target_dir):
-        """Method to change the current directory."""
+        """Method to change the current directory and return the new one."""
         try:
             new_dir = self._current_dir / target_dir
             new_dir.resolve(strict=True)
             os.chdir(new_dir)
             self._current_dir = new_dir
-            print(self._current_dir)
+            return self._current_dir
         except FileNotFoundError:
             return self.errors['os_errors'].get('DirectoryNotFoundError')
 
-    def _ls(self, parameter=None):
-        """Method to list the contents of the current directory or a specified directory."""
+    def _ls(self, *parameters):
+        """Method to list the contents of the current directory or a specified directory.
+
+        Besides -l and -lh it accepts the streaming options, which make it return a generator of lines:
+        - --stream: yields the sorted listing line by line instead of joining it into one string.
+        - -U: yields the entries unsorted, straight from scandir, so memory use does not grow with the directory.
+        - --limit=N and --offset=N: yield only N entries after skipping the first N, implying --stream.
+        """
         available_params = ('-l', '-lh')
-        if parameter in available_params or parameter is None:
-            dir_content = self._dir_content(parameter)
+        show_details, stream, unsorted, offset, limit = None, False, False, 0, None
+        for parameter in parameters:
+            name, _, value = parameter.partition('=')
+            if parameter in available_params:
+                show_details = parameter
+            elif parameter in ('--stream', '-U'):
+                stream, unsorted = True, unsorted or parameter == '-U'
+            elif name in ('--limit', '--offset') and value.isdigit():
+                stream = True
+                if name == '--limit':
+                    limit = int(value)
+                else:
+                    offset = int(value)
+            else:
+                return self.errors['os_errors'].get('InvalidParameterError')
+        if not stream:
+            dir_content = self._dir_content(show_details)
             return '\n'.join(str(i) for i in dir_content)
-        else:
-            return self.errors['os_errors'].get('InvalidParameterError')
+        content = self._iter_dir_content(show_details) if unsorted else iter(self._dir_content(show_details))
+        return islice(content, offset, None if limit is None else offset + limit)
 
     def _dir_content(self, show_details=None):
-        """Helper method to retrieve directory contents based on detail level."""
-        dirs, files = [], []
-        for entry in os.scandir():
-            if entry.is_dir():
-                dirs.append(entry.name)
-            else:
-                if show_details == '-l':
-                    files.append(f'{entry.name} {entry.stat().st_size}')
+        """Helper method to retrieve directory contents based on detail level.
+
+        The names come from the listing cache, the plain listing is formatted once and the sizes of -l and -lh
+        are read on every call, since they change without the directory changing.
+        """
+        listing = self._listings.get(self._current_dir)
+        if show_details == '-l':
+            return listing.dirs + [f'{name} {size}' for name, size in zip(listing.files, listing.sizes())]
+        if show_details == '-lh':
+            return listing.dirs + [f'{name} {self._human_readable_size(size)}'
+                                   for name, size in zip(listing.files, listing.sizes())]
+        if listing.rendered is None:
+            listing.rendered = listing.dirs + listing.files
+        return listing.rendered
+
+    def _iter_dir_content(self, show_details=None):
+        """Yields the directory contents in scandir order without building or caching the listing."""
+        with os.scandir(self._current_dir) as entries:
+            for entry in entries:
+                if show_details is None or entry.is_dir():
+                    yield entry.name
+                elif show_details == '-l':
+                    yield f'{entry.name} {entry.stat().st_size}'
                 elif show_details == '-lh':
-                    files.append(f'{entry.name} {self._human_readable_size(entry.stat().st_size)}')
-                else:
-                    files.append(entry.name)
-        dirs.sort()
-        files.sort()
-        return dirs + files
+                    yield f'{entry.name} {self._human_readable_size(entry.stat().st_size)}'
 
-    def _human_readable_size(self, file_size):
+    @staticmethod
+    def _human_readable_size(file_size):
         """Converts file size to a human-readable format."""
         for unit in ['B', 'KB', 'MB', 'GB', 'TB', 'PB']:
             if file_size < 1024.0 or unit == 'PB':
@@ -185,79 +1647,427 @@ class FileManager:
             file_size /= 1024.0
         return f"{file_size:.0f}{unit}"
 
-    def _rm(self, target):
+    def _rm(self, *args):
         """Remove a file or directory based on the target parameter.
 
         If the target starts with '.', it treats it as an extension and removes all files with that extension in the current directory.
+        Globs and 're:' regexes work the same way and several patterns can be given at once.
         Otherwise, it treats the target as a filename or directory name and attempts to remove it.
+        Patterns and directories are removed by the parallel removal engine, --dry-run only counts what would go
+        and --journal records the removal in the batch journal.
         """
+        options = [arg for arg in args if arg.startswith('--')]
+        targets = [arg for arg in args if not arg.startswith('--')]
+        if not targets:
+            return self.errors['wrong_arguments'].get('rm')
+        if any(option not in ('--dry-run', '--journal') for option in options):
+            return self.errors['os_errors'].get('InvalidParameterError')
+        dry_run = '--dry-run' in options
+        journal = (self._journal_default or '--journal' in options) and not dry_run
+        target = ' '.join(targets)
         try:
-            if target.startswith('.'):
-                return self._remove_files_by_extension(target)
+            if len(targets) > 1 or self._is_pattern(targets[0]):
+                return self._remove_matching_files(targets, dry_run, journal)
             else:
-                return self._remove_target(target)
+                return self._remove_target(target, dry_run, journal)
         except (FileNotFoundError, PermissionError) as e:
             return self.errors['os_errors'].get(type(e))
+        except re.error:
+            return self.errors['os_errors'].get('InvalidPatternError')
         except Exception as e:
-            return f"Error removing '{target}': {e}"
-
-    def _remove_files_by_extension(self, extension):
-        """Remove all files in the current directory with the given extension."""
-        files_removed = False  # Flag to track if any files were removed
-        for file in self._current_dir.iterdir():
-            if file.is_file() and file.name.endswith(extension):
-                file.unlink()
-                files_removed = True  # Set the flag to True if a file is removed
-        if not files_removed:
-            return f"File extension {extension} not found in this directory."
-
-    def _remove_target(self, target):
-        """Remove a specific file or directory."""
+            return ErrorMessage(f"Error removing '{target}': {e}")
+        finally:
+            self._invalidate(self._current_dir)
+
+    def _remove_matching_files(self, patterns, dry_run=False, journal=False):
+        """Remove all files matching any of the patterns, found in a single pass over the directory or tree."""
+        files = [(str(path), size) for path, _, size in self._match_files(patterns)]
+        if not files:
+            return self._no_match_error(patterns)
+        if any('/' in pattern or '**' in pattern for pattern in patterns):
+            self._invalidate_tree(self._current_dir)
+        return self._run_batch(journal, 'rm', files,
+                               lambda batch: self._removal(files, dry_run=dry_run, journal=batch)).summary()
+
+    def _remove_target(self, target, dry_run=False, journal=False):
+        """Remove a specific file or directory, a directory tree is walked and removed in parallel.
+
+        The current directory and its parents are refused, whatever the name they are given by.
+        """
         target_path = self._current_dir / target
-        if target_path.is_dir():
-            shutil.rmtree(target_path)
+        current_dir = self._current_dir.resolve()
+        if target_path.resolve() in (current_dir, *current_dir.parents):
+            return self.errors['os_errors'].get('CurrentDirectoryRemovalError')
+        if target_path.is_dir() and not target_path.is_symlink():
+            self._invalidate_tree(target_path)
+            files, dirs = [], []
+            for scan in self._walker(target_path):
+                if scan.error is not None:
+                    return ErrorMessage(f"Error removing '{target}': {scan.error} ({scan.path})")
+                dirs.append(scan.path)
+                files.extend((os.path.join(scan.path, name), size) for name, size, _ in scan.files)
+            return self._run_batch(journal, 'rm', files,
+                                   lambda batch: self._removal(files, dirs, dry_run, batch), dirs).summary()
+        elif dry_run:
+            return self._removal([(target_path, target_path.lstat().st_size)], dry_run=True).summary()
         else:
             target_path.unlink()
 
+    def _du(self, *parameters):
+        """Method to show the total size of every subdirectory of a directory and of the directory itself.
+
+        Takes an optional directory, the current one by default, and --refresh to ignore the cached sizes.
+        Directories that did not change since the previous du are not read again, only their files are stat-ed.
+        """
+        paths = [parameter for parameter in parameters if parameter != '--refresh']
+        if len(paths) > 1 or any(path.startswith('-') for path in paths):
+            return self.errors['os_errors'].get('InvalidParameterError')
+        if '--refresh' in parameters:
+            self._subtree_sizes.clear()
+        root = self._current_dir / paths[0] if paths else self._current_dir
+        if not root.is_dir():
+            return self.errors['os_errors'].get('DirectoryNotFoundError')
+        scans = list(self._walker(root, self._subtree_sizes))
+        totals, unreadable = {}, 0
+        for scan in reversed(scans):  # Children come after their parents, so they are totalled first.
+            totals[scan.path] = scan.size + sum(totals[os.path.join(scan.path, name)] for name in scan.subdirs)
+            self._subtree_sizes.add(scan)
+            unreadable += scan.error is not None
+        root_scan = scans[0]
+        lines = [f'{name} {self._human_readable_size(totals[os.path.join(root_scan.path, name)])}'
+                 for name in sorted(root_scan.subdirs)]
+        lines.append(f'total {self._human_readable_size(totals[root_scan.path])}')
+        if unreadable:
+            lines.append(f'{unreadable} {"directory" if unreadable == 1 else "directories"} could not be read')
+        return '\n'.join(lines)
+
+    def _dedupe(self, *parameters):
+        """Method to list the files below the current directory that have identical content.
+
+        With --link every duplicate is replaced by a hard link to the first file of its group.
+        """
+        if any(parameter != '--link' for parameter in parameters):
+            return self.errors['os_errors'].get('InvalidParameterError')
+        link = '--link' in parameters
+        groups = self._duplicates(self._current_dir)
+        if not groups:
+            return 'No duplicate files found.'
+        lines, redundant, wasted, errors = [], 0, 0, 0
+        for group in groups:
+            size = os.path.getsize(group[0])
+            lines.append(f'{self._human_readable_size(size)} x{len(group)}')
+            lines.extend(f'  {os.path.relpath(path, self._current_dir)}' for path in group)
+            for duplicate in group[1:]:
+                if link:
+                    try:
+                        self._hard_link(group[0], duplicate)
+                    except OSError as e:
+                        errors += 1
+                        lines.append(f'  Error linking {os.path.relpath(duplicate, self._current_dir)}: '
+                                     f'{self.errors["os_errors"].get(type(e), str(e))}')
+                        continue
+                redundant += 1
+                wasted += size
+        lines.append(f'{len(groups)} duplicate groups, {redundant} redundant files, '
+                     f'{self._human_readable_size(wasted)} {"reclaimed" if link else "reclaimable"}')
+        return ErrorMessage('\n'.join(lines)) if errors else '\n'.join(lines)
+
+    def _hard_link(self, original, duplicate):
+        """Atomically replaces duplicate with a hard link to original."""
+        temporary = f'{duplicate}.dedupe-tmp'
+        os.link(original, temporary)
+        try:
+            os.replace(temporary, duplicate)
+        except OSError:
+            os.unlink(temporary)
+            raise
+        self._invalidate(os.path.dirname(duplicate))
+
+    def _find(self, *parameters):
+        """Method to search the files below the current directory through the file index.
+
+        Takes an optional name glob and the filters --ext=.log, --min-size=10K, --max-size=1M and --limit=N.
+        The index is refreshed first, reading only the directories that changed, unless --no-update is given.
+        With --min-size or --max-size the refresh also stats the indexed files, since a file can grow without its
+        directory changing, other searches show the sizes as of the last time the directory was read.
+        """
+        name, filters, update = None, {}, True
+        for parameter in parameters:
+            option, _, value = parameter.partition('=')
+            if parameter == '--no-update':
+                update = False
+            elif option in ('--min-size', '--max-size') and self._parse_size(value) is not None:
+                filters[option[2:].replace('-', '_')] = self._parse_size(value)
+            elif option == '--limit' and value.isdigit():
+                filters['limit'] = int(value)
+            elif option == '--ext' and value:
+                filters['ext'] = value if value.startswith('.') else f'.{value}'
+            elif not parameter.startswith('-') and name is None:
+                name = parameter
+            else:
+                return self.errors['os_errors'].get('InvalidParameterError')
+        if update:
+            self._index.update(self._current_dir, 'min_size' in filters or 'max_size' in filters)
+        found = self._index.search(self._current_dir, name, **filters)
+        if not found:
+            return 'No files found.'
+        return '\n'.join(f'{os.path.relpath(path, self._current_dir)} {self._human_readable_size(size)}'
+                         for path, size in found)
+
+    @staticmethod
+    def _parse_size(text):
+        """Parses a size such as 512, 10K, 1.5M or 2G into bytes, returns None if the text is not a size."""
+        match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMGT]?)B?', text.upper())
+        if match is None:
+            return None
+        return int(float(match.group(1)) * 1024 ** ' KMGT'.index(match.group(2) or ' '))
+
+    def _invalidate(self, *paths):
+        """Drops the cached listings and sizes of directories changed through the file manager."""
+        self._listings.invalidate(*paths)
+        self._subtree_sizes.invalidate(*paths)
+        self._index.invalidate(*paths)
+
+    def _invalidate_tree(self, path):
+        """Drops the cached listings and sizes of a directory tree changed through the file manager."""
+        self._listings.invalidate_tree(path)
+        self._subtree_sizes.invalidate_tree(path)
+        self._index.invalidate(path)
+
     def _mkdir(self, dir_name):
         """Method to create a new directory."""
         try:
             (self._current_dir / dir_name).mkdir()
         except FileExistsError:
             return self.errors['os_errors'].get(FileExistsError)
+        finally:
+            self._invalidate(self._current_dir)
 
     def _quit(self):
-        """Method to exit the file manager."""
+        """Method to exit the file manager, once the background jobs have finished."""
+        self._jobs.wait()
         sys.exit()
 
+    def _jobs_list(self):
+        """Method to list the background jobs with their state and running time."""
+        return '\n'.join(f'[{job.id}] {job.state:<9} {job.elapsed():8.2f}s  {job.line}'
+                         for job in self._jobs.jobs.values()) or 'No jobs'
+
+    def _wait(self, *job_ids):
+        """Method to wait for a background job, or for all of them, and show their output."""
+        jobs = self._find_jobs(job_ids)
+        if jobs is None:
+            return self.errors['os_errors'].get('InvalidJobError')
+        awaited = self._jobs.wait(jobs[0].id if jobs else None)
+        return self._job_report(awaited)
+
+    def _cancel(self, job_id):
+        """Method to cancel a queued or running background job."""
+        jobs = self._find_jobs([job_id])
+        if jobs is None:
+            return self.errors['os_errors'].get('InvalidJobError')
+        job = self._jobs.cancel(jobs[0].id)
+        if job.state in ('done', 'failed'):
+            return f'[{job.id}] already finished ({job.state})  {job.line}'
+        return f'[{job.id}] {"cancelled" if job.state == "cancelled" else "cancelling"}  {job.line}'
+
+    def _find_jobs(self, job_ids):
+        """Returns the jobs with the given ids, or None if an id is unknown."""
+        if len(job_ids) > 1:
+            return None
+        jobs = []
+        for job_id in job_ids:
+            job = self._jobs.jobs.get(int(job_id)) if job_id.isdigit() else None
+            if job is None:
+                return None
+            jobs.append(job)
+        return jobs
+
+    def _job_report(self, jobs):
+        """Formats finished jobs as a status line followed by their output, an ErrorMessage if any job failed."""
+        lines = []
+        for job in jobs:
+            job.reported = True
+            lines.append(f'[{job.id}] {job.state} in {job.elapsed():.2f}s  {job.line}')
+            if job.result:
+                lines.append(str(job.result))
+        report = '\n'.join(lines)
+        return ErrorMessage(report) if any(job.state == 'failed' for job in jobs) else report
+
+    def _cancel_event(self):
+        """Returns the cancel event of the job running on the calling thread, None outside of background jobs."""
+        job = getattr(self._job_context, 'job', None)
+        return job.cancel if job is not None else None
+
+    def _run_job(self, job):
+        """Executes the command line of a job on the job's thread, in the directory it was submitted from."""
+        self._job_context.job = job
+        self._job_context.current_dir = job.directory
+        try:
+            return self.execute(job.line)
+        finally:
+            self._job_context.job = None
+            self._job_context.current_dir = None
+
+    def _submit(self, command_name, args, line):
+        """Submits a command as a background job, keyed on the filesystem it writes to."""
+        target = self._current_dir
+        if command_name in ('cp', 'mv'):
+            paths = [arg for arg in args if not arg.startswith('--')]
+            if paths:
+                target = self._current_dir / paths[-1]
+        while not target.exists() and target != target.parent:
+            target = target.parent
+        job = self._jobs.submit(line, self._current_dir, target.stat().st_dev)
+        return f'[{job.id}] {job.state}  {line}'
+
+    def execute(self, line):
+        """Executes a single command line and returns its result, an ErrorMessage if the command failed.
+
+        A line ending with '&' is submitted as a background job instead, if the command supports it.
+        """
+        background = line.rstrip().endswith('&')
+        line = line.rstrip().rstrip('&')
+        if not line.split():
+            return self.errors['os_errors'].get('WrongCommandError')
+        command_name, *args = line.split()
+        command = self._commands.get(command_name)
+        if not command:
+            return self.errors['os_errors'].get('WrongCommandError')
+        if len(args) < command.num_args and not command.multiarg:
+            return self.errors['wrong_arguments'].get(command_name)
+        if background:
+            if not command.background:
+                return self.errors['os_errors'].get('ForegroundOnlyError')
+            return self._submit(command_name, args, line.strip())
+        try:
+            return command(*args)
+        except TypeError:
+            return self.errors['os_errors'].get(TypeError)
+        except JobCancelledError:
+            raise
+        except Exception as e:
+            return ErrorMessage(f"Error running '{command_name}': {e}")
+
     def run(self):
         """Main loop to run the file manager, accepting and executing commands."""
         print('Input the command:')
         while True:
-            user_input = input().split()
-            if not user_input:
+            user_input = input()
+            if not user_input.split():
                 print('Input command')
             else:
-                command_name, *args = user_input
-                command = self._commands.get(command_name)
-                if command:
-                    if len(args) >= command.num_args or command.multiarg:
+                result = self.execute(user_input)
+                if isinstance(result, Iterator):
+                    try:
+                        for line in result:
+                            print(line)
+                    except Exception as e:
+                        print(ErrorMessage(f"Error running '{user_input.split()[0]}': {e}"))
+                elif result:
+                    print(result)
+                finished = self._jobs.finished()
+                if finished:
+                    print(self._job_report(finished))
+
+    def run_script(self, lines, keep_going=False, timings=False):
+        """Runs a script of commands, one per line, and returns the exit status of the whole run.
+
+        Blank lines and lines starting with '#' are ignored. The output is buffered and written once at the end,
+        even if the run is interrupted, the run stops at the first failed command unless keep_going is set,
+        and a quit command ends the script. A command that breaks while streaming its output fails like any other.
+        Background jobs are waited for before the script returns, their output comes after the other commands.
+        With timings set, the output ends with the number of runs and the mean and maximum latency of every command.
+        """
+        output, latencies, failed = [], {}, False
+        try:
+            try:
+                for line in lines:
+                    if not line.strip() or line.lstrip().startswith('#'):
+                        continue
+                    start = time.perf_counter()
+                    result = self.execute(line)
+                    latencies.setdefault(line.split()[0], []).append(time.perf_counter() - start)
+                    if isinstance(result, Iterator):
                         try:
-                            result = command(*args)
-                            if result:
-                                print(result)
-                        except TypeError:
-                            print(self.errors['os_errors'].get(TypeError))
-                    else:
-                        print(self.errors['wrong_arguments'].get(command_name))
-                else:
-                    print(self.errors['os_errors'].get('WrongCommandError'))
+                            self._stream(result, output)
+                        except Exception as e:
+                            result = ErrorMessage(f"Error running '{line.split()[0]}': {e}")
+                            output.append(result)
+                    elif result:
+                        output.append(str(result))
+                    if isinstance(result, ErrorMessage):
+                        failed = True
+                        if not keep_going:
+                            break
+            except SystemExit:
+                pass
+            self._jobs.wait()
+            finished = self._jobs.finished()
+            if finished:
+                report = self._job_report(finished)
+                output.append(report)
+                failed = failed or isinstance(report, ErrorMessage)
+            if timings:
+                output.append(self._latency_table(latencies))
+        finally:
+            if output:
+                sys.stdout.write('\n'.join(output) + '\n')
+        return 1 if failed else 0
+
+    @staticmethod
+    def _stream(lines, output, chunk_size=1000):
+        """Writes the buffered output, then the streamed lines in chunks, so they are never all held in memory."""
+        if output:
+            sys.stdout.write('\n'.join(output) + '\n')
+            output.clear()
+        while chunk := list(islice(lines, chunk_size)):
+            sys.stdout.write('\n'.join(chunk) + '\n')
+
+    @staticmethod
+    def _latency_table(latencies):
+        """Formats the per-command latencies collected by run_script as a table, slowest commands first."""
+        lines = [f'{"command":<10}{"runs":>8}{"mean ms":>12}{"max ms":>12}']
+        for name, samples in sorted(latencies.items(), key=lambda item: -sum(item[1])):
+            lines.append(f'{name:<10}{len(samples):>8}{sum(samples) / len(samples) * 1000:>12.3f}'
+                         f'{max(samples) * 1000:>12.3f}')
+        return '\n'.join(lines)
+
+
+def parse_arguments():
+    """Parses the command line arguments of the file manager."""
+    parser = argparse.ArgumentParser(description='A simple file manager.')
+    parser.add_argument('script', nargs='?',
+                        help='run the commands of this file, one per line, "-" reads them from stdin')
+    parser.add_argument('--keep-going', action='store_true', help='do not stop the script at the first error')
+    parser.add_argument('--timings', action='store_true', help='print the latency of every command of the script')
+    parser.add_argument('--workers', type=int, help='number of threads used by extension-wide cp and mv')
+    parser.add_argument('--conflict', choices=ConflictPolicy.POLICIES,
+                        help='policy for existing destinations, defaults to ask, or skip when running a script')
+    parser.add_argument('--index', type=Path, help=f'location of the find index, defaults to {FileManager.INDEX_PATH}')
+    parser.add_argument('--journal', action='store_true', help='journal every bulk cp, mv and rm')
+    parser.add_argument('--stats', action='store_true', help='measure every command, see the stats command')
+    parser.add_argument('--journal-path', type=Path,
+                        help=f'location of the batch journal, defaults to {FileManager.JOURNAL_PATH}')
+    return parser.parse_args()
 
 
 def main():
     """Main function to run the file manager."""
-    file_manager = FileManager()
-    file_manager.run()
+    args = parse_arguments()
+    if args.script is None:
+        file_manager = FileManager(args.workers, args.conflict or 'ask', index_path=args.index, journal=args.journal,
+                                   journal_path=args.journal_path, stats=args.stats)
+        file_manager.run()
+    else:
+        file_manager = FileManager(args.workers, args.conflict or 'skip', index_path=args.index, journal=args.journal,
+                                   journal_path=args.journal_path, stats=args.stats)
+        if args.script == '-':
+            lines = sys.stdin.read().splitlines()
+        else:
+            with open(args.script) as script:
+                lines = script.read().splitlines()
+        sys.exit(file_manager.run_script(lines, args.keep_going, args.timings))
 
 
 if __name__ == '__main__':
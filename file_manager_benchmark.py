@@ -0,0 +1,244 @@
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+from pathlib import Path
+
+from file_manager import FileManager, ErrorMessage
+
+
+"""Defines a class that generates the synthetic directory trees the benchmarks run on."""
+
+
+class TreeGenerator:
+    BLOCK_SIZE = 1024 * 1024  # Size of the random block large files are written from.
+
+    def __init__(self, root, scale=1.0):
+        self.root = Path(root)  # Directory the trees are generated in.
+        self.scale = scale  # Multiplier applied to the number of files and the size of the large files.
+        self._block = os.urandom(self.BLOCK_SIZE)  # Random data shared by every generated file.
+
+    def scaled(self, value):
+        """Returns value multiplied by the scale, at least 1."""
+        return max(1, int(value * self.scale))
+
+    def small_files(self, name, count=10000, size=1024, extensions=('.txt', '.log')):
+        """Generates a flat directory of count small files, their extensions taken in turn from extensions."""
+        path = self._fresh(name)
+        data = self._block[:size]
+        for number in range(self.scaled(count)):
+            (path / f'file{number}{extensions[number % len(extensions)]}').write_bytes(data)
+        return path
+
+    def large_files(self, name, count=2, size=256 * 1024 * 1024):
+        """Generates a directory of count large files of random data."""
+        path = self._fresh(name)
+        size = self.scaled(size)
+        for number in range(count):
+            with open(path / f'large{number}.bin', 'wb') as file:
+                for offset in range(0, size, self.BLOCK_SIZE):
+                    file.write(self._block[:min(self.BLOCK_SIZE, size - offset)])
+        return path
+
+    def deep_tree(self, name, depth=10, width=2, files_per_dir=4, size=512):
+        """Generates a tree of directories depth levels deep, each with width subdirectories and a few files."""
+        path = self._fresh(name)
+        data = self._block[:size]
+        level = [path]
+        for current_depth in range(depth):
+            next_level = []
+            for directory in level:
+                for number in range(files_per_dir):
+                    (directory / f'leaf{number}.{"txt" if number % 2 else "log"}').write_bytes(data)
+                if current_depth < depth - 1:
+                    for number in range(width):
+                        subdir = directory / f'dir{number}'
+                        subdir.mkdir()
+                        next_level.append(subdir)
+            level = next_level
+        return path
+
+    def _fresh(self, name):
+        """Returns an empty directory called name under the root, removing what was left there before."""
+        path = self.root / name
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        return path
+
+
+"""Defines a class that describes one benchmarked command and the tree it runs on."""
+
+
+class BenchmarkCase:
+    def __init__(self, name, tree, command, destructive=False, warm=False, target=None):
+        self.name = name  # Name the case is reported under.
+        self.tree = tree  # Callable generating the tree and returning the directory the command runs in.
+        self.command = command  # The file manager command line being timed.
+        self.destructive = destructive  # True if the command changes the tree, so it is regenerated before each run.
+        self.warm = warm  # True if the command runs once untimed first, to measure the cached path.
+        self.target = target  # Directory emptied before each run, where the command writes its output.
+
+
+"""Defines a class that runs the benchmark cases and reports their timings as a table or JSON."""
+
+
+class Benchmark:
+    def __init__(self, root, scale=1.0, repeat=3, workers=None):
+        self.root = Path(root)  # Scratch directory holding the trees and the file manager index.
+        self.repeat = repeat  # Number of timed runs of every case.
+        self.workers = workers  # Worker threads given to the file manager.
+        self.trees = TreeGenerator(self.root / 'trees', scale)
+        self.scale = scale
+
+    def cases(self):
+        """Returns the benchmark cases, listing, copying, moving and removing on every kind of tree."""
+        trees = self.trees
+        small = lambda: trees.small_files('small')
+        large = lambda: trees.large_files('large')
+        deep = lambda: trees.deep_tree('deep')
+        copies = self.root / 'copies'
+        return [
+            BenchmarkCase('ls small', small, 'ls'),
+            BenchmarkCase('ls small cached', small, 'ls', warm=True),
+            BenchmarkCase('ls -l small', small, 'ls -l'),
+            BenchmarkCase('cp .txt small', small, f'cp .txt {copies} --conflict=overwrite', target=copies),
+            BenchmarkCase('mv .log small', small, f'mv .log {copies} --conflict=overwrite', True, target=copies),
+            BenchmarkCase('rm .log small', small, 'rm .log', True),
+            BenchmarkCase('cp large', large, f'cp large0.bin {copies} --conflict=overwrite', target=copies),
+            BenchmarkCase('du deep', deep, 'du'),
+            BenchmarkCase('find deep', deep, 'find leaf1.txt'),
+            BenchmarkCase('dedupe deep', deep, 'dedupe'),
+            BenchmarkCase('rm -r deep', lambda: trees.deep_tree('removed/deep').parent, 'rm deep', True),
+        ]
+
+    def __call__(self, names=None):
+        """Runs the cases, or only those whose name contains one of names, and returns their results."""
+        results, cwd = [], os.getcwd()
+        try:
+            for case in self.cases():
+                if names and not any(name in case.name for name in names):
+                    continue
+                results.append(self._run_case(case))
+        finally:
+            os.chdir(cwd)  # The file manager changes the working directory into the trees.
+        return results
+
+    def _run_case(self, case):
+        """Times the runs of one case, each on a new file manager and index so that only warm cases hit caches."""
+        samples, io_totals, errors, directory, files = [], {'read_bytes': 0, 'written_bytes': 0}, [], None, 0
+        for _ in range(self.repeat):
+            os.chdir(self.root)
+            if directory is None or case.destructive:
+                directory = case.tree()
+                files = sum(len(names) for _, _, names in os.walk(directory))
+            if case.target is not None:
+                if case.target.exists():
+                    shutil.rmtree(case.target)
+                case.target.mkdir(parents=True)
+            index_path = self.root / 'index.sqlite'
+            if index_path.exists():
+                index_path.unlink()
+            file_manager = FileManager(self.workers, 'overwrite', index_path=index_path, stats=True)
+            with redirect_stdout(io.StringIO()):
+                file_manager.execute(f'cd {directory}')
+                if case.warm:
+                    self._consume(file_manager.execute(case.command))
+                file_manager.execute('stats reset')
+                start = time.perf_counter()
+                result = self._consume(file_manager.execute(case.command))
+                samples.append(time.perf_counter() - start)
+            if isinstance(result, ErrorMessage):
+                errors.append(str(result))
+            stats = file_manager._stats.commands.get(case.command.split()[0], {})
+            for key in io_totals:
+                io_totals[key] += stats.get(key, 0)
+        return {
+            'name': case.name,
+            'command': case.command.replace(str(self.root), '<root>'),
+            'files': files,
+            'runs': len(samples),
+            'mean_ms': statistics.mean(samples) * 1000,
+            'min_ms': min(samples) * 1000,
+            'max_ms': max(samples) * 1000,
+            'read_bytes': io_totals['read_bytes'] // len(samples),
+            'written_bytes': io_totals['written_bytes'] // len(samples),
+            'errors': errors,
+        }
+
+    @staticmethod
+    def _consume(result):
+        """Drains a streamed command result, so its whole cost is part of the timing."""
+        if hasattr(result, '__next__'):
+            for _ in result:
+                pass
+        return result
+
+    def to_json(self, results):
+        """Returns the results with the details of the run, for comparing with later runs."""
+        return json.dumps({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'scale': self.scale,
+            'repeat': self.repeat,
+            'results': results,
+        }, indent=2)
+
+    @staticmethod
+    def table(results, baseline=None):
+        """Formats the results as a table, with the change from the baseline results when given."""
+        previous = {result['name']: result for result in baseline or ()}
+        header = f'{"case":<18}{"files":>8}{"mean ms":>12}{"min ms":>12}{"max ms":>12}{"read":>10}{"written":>10}'
+        lines = [header + (f'{"change":>10}' if baseline else '')]
+        for result in results:
+            line = (f'{result["name"]:<18}{result["files"]:>8}{result["mean_ms"]:>12.1f}{result["min_ms"]:>12.1f}'
+                    f'{result["max_ms"]:>12.1f}{FileManager._human_readable_size(result["read_bytes"]):>10}'
+                    f'{FileManager._human_readable_size(result["written_bytes"]):>10}')
+            if result['name'] in previous and previous[result['name']]['mean_ms']:
+                change = result['mean_ms'] / previous[result['name']]['mean_ms'] - 1
+                line += f'{change:>+10.1%}'
+            if result['errors']:
+                line += f'  error: {result["errors"][0]}'
+            lines.append(line)
+        return '\n'.join(lines)
+
+
+def parse_arguments():
+    """Parses the command line arguments of the benchmark."""
+    parser = argparse.ArgumentParser(description='Benchmarks the file manager commands on synthetic trees.')
+    parser.add_argument('cases', nargs='*', help='run only the cases whose name contains one of these')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier for the number of files and the size of the large files')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of every case')
+    parser.add_argument('--workers', type=int, help='worker threads of the file manager')
+    parser.add_argument('--dir', type=Path, help='scratch directory, a temporary one is created and removed if unset')
+    parser.add_argument('--json', type=Path, help='also write the results to this JSON file')
+    parser.add_argument('--baseline', type=Path, help='JSON results of an earlier run to compare with')
+    return parser.parse_args()
+
+
+def main():
+    """Main function to run the benchmark and print its results."""
+    args = parse_arguments()
+    baseline = json.loads(args.baseline.read_text())['results'] if args.baseline else None
+    with tempfile.TemporaryDirectory(prefix='file_manager_benchmark_', dir=args.dir) as root:
+        benchmark = Benchmark(root, args.scale, args.repeat, args.workers)
+        results = benchmark(args.cases)
+        print(benchmark.table(results, baseline))
+        if args.json:
+            args.json.write_text(benchmark.to_json(results))
+    if any(result['errors'] for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,903 @@
 import argparse
+import csv
+import json
 import math
+import os
+import random
+import statistics
+import sys
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+from fractions import Fraction
+from functools import lru_cache
+from itertools import accumulate, islice, repeat
+
+
+class AmortizationSchedule:
+    """
+    The full amortization schedule of a loan, stored as columns with one value per month.
+
+    Every column is computed from a closed-form expression of the month number, so the whole schedule is built in
+    one pass per column instead of month by month. A single loan is built with its principal directly. Schedules are
+    linear in the principal, so build_many() builds a schedule for a principal of 1 once per loan type, number of
+    periods and interest rate and scales it for every loan sharing them.
+
+    Attributes:
+    - payment: Payment of every month.
+    - interest: Interest part of every payment.
+    - principal: Principal part of every payment.
+    - balance: Remaining balance after every payment.
+    - loan_type, interest_rate: Terms the schedule was built with, None for a schedule built from columns.
+
+    Methods:
+    - build(): Builds the schedule of a single loan.
+    - build_many(): Builds the schedules of many loans, sharing the work between loans with the same terms.
+    - with_prepayments(): Recomputes the schedule after extra payments, from the month of the first one onward.
+    - rows(): Yields the schedule month by month.
+    - total_paid(): Calculates the sum of all payments.
+    """
+    COLUMNS = ('payment', 'interest', 'principal', 'balance')
+    TYPES = ('annuity', 'diff')
+
+    def __init__(self, payment, interest, principal, balance, loan_type=None, interest_rate=None):
+        self.payment = payment
+        self.interest = interest
+        self.principal = principal
+        self.balance = balance
+        self.loan_type = loan_type
+        self.interest_rate = interest_rate
+
+    def __len__(self):
+        return len(self.payment)
+
+    @classmethod
+    def build(cls, loan_type, principal, periods, interest_rate):
+        """
+        Builds the schedule of a single loan.
+
+        Args:
+        - loan_type: 'annuity' or 'diff'.
+        - principal: Principal loan amount.
+        - periods: Number of monthly payments.
+        - interest_rate: Monthly interest rate.
+
+        Returns:
+        - The AmortizationSchedule of the loan.
+        """
+        return cls(*cls._columns(loan_type, periods, interest_rate, principal), loan_type, interest_rate)
+
+    @classmethod
+    def build_many(cls, loans):
+        """
+        Builds the schedules of many loans, the unit schedule of every distinct set of terms is built only once.
+
+        Args:
+        - loans: Iterable of (loan_type, principal, periods, interest_rate) tuples.
+
+        Returns:
+        - List of AmortizationSchedule, in the order of the loans.
+        """
+        units = {}
+        schedules = []
+        for loan_type, principal, periods, interest_rate in loans:
+            terms = (loan_type, periods, interest_rate)
+            if terms not in units:
+                units[terms] = cls._columns(*terms)
+            schedules.append(cls._scale(units[terms], principal, loan_type, interest_rate))
+        return schedules
+
+    @classmethod
+    def _scale(cls, unit, principal, loan_type=None, interest_rate=None):
+        """
+        Scales the columns of a unit schedule to a principal.
+        """
+        return cls(*(array('d', [value * principal for value in column]) for column in unit),
+                   loan_type=loan_type, interest_rate=interest_rate)
+
+    def with_prepayments(self, prepayments):
+        """
+        Recomputes the schedule after extra payments.
+
+        The months before a prepayment are copied as they are and only the following months are recomputed, so
+        evaluating many prepayment strategies of a loan costs the recomputed months only. Several prepayments are
+        applied in the order of their months.
+
+        Args:
+        - prepayments: Iterable of Prepayment.
+
+        Returns:
+        - A new AmortizationSchedule, this one is left unchanged.
+
+        Raises:
+        - ValueError: If the schedule was not built from loan terms or a prepayment falls outside of it.
+        """
+        if self.loan_type is None:
+            raise ValueError(INCORRECT_PARAMETERS)
+        schedule = self
+        for prepayment in sorted(prepayments, key=lambda prepayment: prepayment.month):
+            schedule = schedule._prepay(prepayment)
+        return schedule
+
+    def _prepay(self, prepayment):
+        """
+        Applies one prepayment, paid with the payment of its month, and recomputes the following months.
+        """
+        month = prepayment.month
+        if not 1 <= month <= len(self):
+            raise ValueError(INCORRECT_PARAMETERS)
+        payment, interest, principal, balance = (column[:month] for column in
+                                                 (self.payment, self.interest, self.principal, self.balance))
+        amount = min(prepayment.amount, balance[-1])
+        payment[-1] += amount
+        principal[-1] += amount
+        balance[-1] -= amount
+        remaining, months = balance[-1], len(self) - month
+        if months and remaining > 0:
+            if prepayment.mode == 'payment':
+                tail = self._tail_unit(self.loan_type, months, self.interest_rate)
+                tail = [[value * remaining for value in column] for column in tail]
+            else:
+                tail = self._shortened_tail(remaining, self.payment[month] if self.loan_type == 'annuity'
+                                            else self.principal[month])
+            for column, values in zip((payment, interest, principal, balance), tail):
+                column.extend(values)
+        else:
+            balance[-1] = 0.0
+        return AmortizationSchedule(payment, interest, principal, balance, self.loan_type, self.interest_rate)
+
+    def _shortened_tail(self, balance, regular):
+        """
+        Builds the months left after a prepayment that reduces the term.
+
+        Args:
+        - balance: Balance left after the prepayment.
+        - regular: Payment of an annuity, or principal part of a differentiated loan, kept unchanged.
+
+        Returns:
+        - Tuple of the payment, interest, principal and balance columns, the last month paying off the balance.
+        """
+        rate = self.interest_rate
+        if self.loan_type == 'diff' or not rate:
+            # The same principal is repaid every month, an annuity without interest repays its whole payment.
+            months = max(1, math.ceil(balance / regular - 1e-9))
+            balances = [max(0.0, balance - regular * (month + 1)) for month in range(months)]
+            balances[-1] = 0.0
+            principals = [previous - current for previous, current in zip([balance] + balances, balances)]
+            interests = [rate * previous for previous in [balance] + balances[:-1]]
+            return [principal + part for principal, part in zip(principals, interests)], interests, principals, \
+                balances
+        months = max(1, math.ceil(math.log(regular / (regular - rate * balance), 1 + rate) - 1e-9))
+        payments, interests, principals, balances = [], [], [], []
+        for month in range(months):
+            interest = balance * rate
+            principal = balance if month == months - 1 else min(regular - interest, balance)
+            balance -= principal
+            payments.append(principal + interest)
+            interests.append(interest)
+            principals.append(principal)
+            balances.append(balance)
+        return payments, interests, principals, balances
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _tail_unit(cls, loan_type, periods, interest_rate):
+        """
+        Returns the unit schedule of the months left after a prepayment that reduces the payment, cached since the
+        prepayment strategies of a loan share their remaining terms.
+        """
+        return cls._columns(loan_type, periods, interest_rate)
+
+    @classmethod
+    def _columns(cls, loan_type, periods, interest_rate, principal=1.0):
+        """
+        Builds the columns of the schedule of a loan, of a unit schedule with the default principal of 1.
+
+        Args:
+        - loan_type: 'annuity' or 'diff'.
+        - periods: Number of monthly payments.
+        - interest_rate: Monthly interest rate.
+        - principal: Principal loan amount.
+
+        Returns:
+        - Tuple of the payment, interest, principal and balance columns.
+        """
+        if loan_type not in cls.TYPES or periods <= 0 or interest_rate < 0:
+            raise ValueError("Incorrect parameters")
+        months = range(periods)
+        if loan_type == 'diff':
+            repaid = principal / periods
+            principal_part = array('d', repeat(repaid, periods))
+            balance = array('d', [principal - (month + 1) * repaid for month in months])
+            interest = array('d', [interest_rate * (principal - month * repaid) for month in months])
+            payment = array('d', [repaid + part for part in interest])
+        else:
+            if interest_rate == 0:
+                monthly = principal / periods
+                balance = array('d', [principal - (month + 1) * monthly for month in months])
+            else:
+                # The balance after k payments is principal * growth - monthly * (growth - 1) / rate, growth being
+                # (1 + rate) ** k, which is offset + slope * growth.
+                numerator, denominator = annuity_factor(interest_rate, periods)
+                monthly = principal * numerator / denominator
+                offset = monthly / interest_rate
+                slope = principal - offset
+                growth = accumulate(repeat(1 + interest_rate, periods), lambda total, factor: total * factor)
+                balance = array('d', [offset + slope * value for value in growth])
+            balance[-1] = 0.0
+            payment = array('d', repeat(monthly, periods))
+            interest = array('d', [interest_rate * principal])
+            interest.extend([interest_rate * value for value in balance[:-1]])
+            principal_part = array('d', [monthly - part for part in interest])
+        return payment, interest, principal_part, balance
+
+    def rows(self):
+        """
+        Yields the schedule month by month.
+
+        Returns:
+        - Iterator of (month, payment, interest, principal, balance) tuples, months counted from 1.
+        """
+        return zip(range(1, len(self) + 1), self.payment, self.interest, self.principal, self.balance)
+
+    def total_paid(self):
+        """
+        Calculates the sum of all payments of the schedule.
+
+        Returns:
+        - Total amount paid over the loan period.
+        """
+        return math.fsum(self.payment)
+
+    def format(self):
+        """
+        Formats the schedule as a table, one line per month.
+
+        Returns:
+        - The formatted table.
+        """
+        lines = [f'{"Month":>5} {"Payment":>14} {"Interest":>14} {"Principal":>14} {"Balance":>16}']
+        for month, payment, interest, principal, balance in self.rows():
+            lines.append(f'{month:>5} {payment:>14.2f} {interest:>14.2f} {principal:>14.2f} {balance:>16.2f}')
+        return '\n'.join(lines)
+
+
+class Prepayment:
+    """
+    An extra payment of a loan, made together with the payment of a month.
+
+    Attributes:
+    - month: Month of the prepayment, counted from 1.
+    - amount: Amount paid on top of the payment of the month.
+    - mode: 'term' to keep the payment and shorten the loan, 'payment' to keep the term and lower the payments.
+
+    Methods:
+    - parse(): Parses a prepayment written as MONTH:AMOUNT[:MODE].
+    """
+    MODES = ('term', 'payment')
+
+    def __init__(self, month, amount, mode='term'):
+        if month < 1 or amount < 0 or mode not in self.MODES:
+            raise ValueError(INCORRECT_PARAMETERS)
+        self.month = month
+        self.amount = amount
+        self.mode = mode
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Parses a prepayment written as MONTH:AMOUNT[:MODE], as given on the command line.
+
+        Returns:
+        - The Prepayment.
+        """
+        month, amount, *mode = text.split(':')
+        return cls(int(month), float(amount), *mode)
+
+
+LOAN_TYPES = ('annuity', 'diff')
+ANNUITY_FACTOR_CACHE_SIZE = 4096
+INCORRECT_PARAMETERS = 'Incorrect parameters'
+PAYMENT_BELOW_INTEREST = 'The payment does not cover the interest, the loan is never repaid'
+
+
+def monthly_interest_rate(interest):
+    """
+    Converts a nominal annual interest in percent to the monthly interest rate.
+
+    Args:
+    - interest: Annual interest in percent.
+
+    Returns:
+    - Monthly interest rate.
+    """
+    return interest / (12 * 100)
+
+
+def diff_payments(periods, principal, interest_rate):
+    """
+    Calculates the rounded up payments of a differentiated loan.
+
+    Returns:
+    - List of the monthly payments.
+    """
+    return [math.ceil(round(principal / periods + interest_rate * (principal - ((principal * month - 1) / periods)),
+                            2)) for month in range(0, periods)]
+
+
+@lru_cache(maxsize=ANNUITY_FACTOR_CACHE_SIZE)
+def annuity_factor(interest_rate, periods):
+    """
+    Calculates the annuity factor of a monthly rate and number of periods, the monthly payment per unit of principal.
+
+    Quotes share a small set of rates and terms, so the factors are kept in a bounded LRU cache and a repeated quote
+    costs a multiplication instead of a pow. annuity_factor.cache_info() reports the hits and misses.
+
+    Returns:
+    - Tuple of the numerator and denominator of the factor, kept apart so that payments are computed with the
+      same rounding as the uncached formula.
+    """
+    growth = pow(1 + interest_rate, periods)
+    return interest_rate * growth, growth - 1
+
+
+def annuity_payment(periods, principal, interest_rate):
+    """
+    Calculates the rounded up monthly payment of an annuity loan.
+
+    Returns:
+    - Monthly payment.
+    """
+    numerator, denominator = annuity_factor(interest_rate, periods)
+    return math.ceil(principal * numerator / denominator)
+
+
+def loan_principal(payment, periods, interest_rate):
+    """
+    Calculates the rounded down principal an annuity payment repays over the periods.
+
+    Returns:
+    - Loan principal.
+    """
+    numerator, denominator = annuity_factor(interest_rate, periods)
+    return math.floor(payment / (numerator / denominator))
+
+
+def months_to_pay(payment, principal, interest_rate):
+    """
+    Calculates the number of months an annuity payment takes to repay the principal, rounded up.
+
+    Returns:
+    - Number of months.
+
+    Raises:
+    - ValueError: If the payment does not cover the interest of the first month.
+    """
+    if payment <= interest_rate * principal:
+        raise ValueError(PAYMENT_BELOW_INTEREST)
+    return math.ceil(math.log(payment / (payment - interest_rate * principal), 1 + interest_rate))
+
+
+def newton_bracketed(function, low, high, guess, tolerance=1e-12, max_iterations=100):
+    """
+    Finds the root of an increasing function between low and high with Newton's method.
+
+    Every evaluation narrows the bracket around the root, and a Newton step that would leave the bracket is replaced
+    by a bisection step, so the search converges quadratically near the root and never diverges.
+
+    Args:
+    - function: Callable returning the value of the function and its derivative at a point.
+    - low, high: Bracket of the root, the function is negative at low and positive at high.
+    - guess: Starting point inside the bracket.
+    - tolerance: Absolute size of the last step at which the search stops.
+    - max_iterations: Number of steps after which the search gives up.
+
+    Returns:
+    - The root.
+
+    Raises:
+    - ValueError: If the search does not converge.
+    """
+    point = guess if low < guess < high else (low + high) / 2
+    for _ in range(max_iterations):
+        value, derivative = function(point)
+        if value < 0:
+            low = point
+        else:
+            high = point
+        following = point - value / derivative if derivative else high + 1
+        if not low < following < high:
+            following = (low + high) / 2
+        if abs(following - point) <= tolerance:
+            return following
+        point = following
+    raise ValueError(INCORRECT_PARAMETERS)
+
+
+def annuity_interest(payment, principal, periods):
+    """
+    Solves the annual interest at which an annuity payment repays the principal over the periods.
+
+    The monthly rate is found by newton_bracketed() between zero and payment / principal, where the annuity
+    payment is at least the interest alone, starting from the rate of a loan paying a flat interest.
+
+    Returns:
+    - Annual interest in percent.
+
+    Raises:
+    - ValueError: If the payments do not even repay the principal without interest.
+    """
+    if payment * periods < principal:
+        raise ValueError(INCORRECT_PARAMETERS)
+    if payment * periods == principal:
+        return 0.0
+
+    def excess_payment(rate):
+        repaid = -math.expm1(-periods * math.log1p(rate))  # 1 - (1 + rate) ** -periods, exact near a zero rate
+        annuity = principal * rate / repaid
+        derivative = principal * (repaid - rate * periods * (1 - repaid) / (1 + rate)) / repaid ** 2
+        return annuity - payment, derivative
+
+    guess = 2 * (payment * periods - principal) / (principal * (periods + 1))
+    return newton_bracketed(excess_payment, 0.0, payment / principal, guess) * 12 * 100
+
+
+def annuity_interests(quotes):
+    """
+    Solves the annual interest of many annuity quotes.
+
+    Args:
+    - quotes: Iterable of (payment, principal, periods) tuples.
+
+    Returns:
+    - List of the annual interests in percent, None for the quotes that cannot be solved.
+    """
+    solved = {}
+    interests = []
+    for quote in quotes:
+        if quote not in solved:
+            try:
+                solved[quote] = annuity_interest(*quote)
+            except (ValueError, ZeroDivisionError, OverflowError):
+                solved[quote] = None
+        interests.append(solved[quote])
+    return interests
+
+
+@lru_cache(maxsize=ANNUITY_FACTOR_CACHE_SIZE)
+def exact_annuity_factor(interest, periods):
+    """
+    Calculates the annuity factor of an annual interest in percent with decimal arithmetic, cached like
+    annuity_factor().
+
+    Returns:
+    - Decimal monthly payment per unit of principal.
+    """
+    rate = Decimal(str(interest)) / 1200
+    growth = (1 + rate) ** periods
+    return rate * growth / (growth - 1)
+
+
+class ExactSchedule:
+    """
+    The amortization schedule of a loan in integer cents, every amount rounded half up to the cent as it is paid.
+
+    The interest of a month is the balance times the exact monthly rate, a fraction of the decimal interest, rounded
+    with integer arithmetic, so the schedule does not depend on binary floating point. A differentiated loan repays
+    its principal in parts rounded so that the balance stays within half a cent of the exact one. The last month
+    pays what is left of the balance, which absorbs the rounding of an annuity payment.
+
+    Attributes:
+    - payment, interest, principal, balance: array('q') columns in cents, one value per month.
+
+    Methods:
+    - build(): Builds the exact schedule of a loan.
+    - to_schedule(): Converts the schedule to an AmortizationSchedule in currency units.
+    """
+    def __init__(self, payment, interest, principal, balance):
+        self.payment = payment
+        self.interest = interest
+        self.principal = principal
+        self.balance = balance
+
+    def __len__(self):
+        return len(self.payment)
+
+    @classmethod
+    def build(cls, loan_type, principal, periods, interest):
+        """
+        Builds the exact schedule of a loan.
+
+        Args:
+        - loan_type: 'annuity' or 'diff'.
+        - principal: Principal loan amount.
+        - periods: Number of monthly payments.
+        - interest: Annual interest in percent.
+
+        Returns:
+        - The ExactSchedule of the loan.
+        """
+        if loan_type not in LOAN_TYPES or periods <= 0 or interest < 0 or principal < 0:
+            raise ValueError(INCORRECT_PARAMETERS)
+        rate = Fraction(Decimal(str(interest))) / 1200
+        numerator, denominator = rate.numerator * 2, rate.denominator * 2
+        balance = int((Decimal(str(principal)) * 100).quantize(Decimal(1), ROUND_HALF_UP))
+        total = balance
+        if loan_type == 'diff':
+            regular = None
+        elif interest:
+            regular = int((balance * exact_annuity_factor(interest, periods)).quantize(Decimal(1), ROUND_HALF_UP))
+        else:
+            regular = -(-balance // periods)
+        payments, interests, principals, balances = array('q'), array('q'), array('q'), array('q')
+        for month in range(periods, 0, -1):
+            interest_part = (balance * numerator + rate.denominator) // denominator
+            if month == 1:
+                principal_part = balance
+            elif loan_type == 'diff':
+                # Repaid so far is the principal times the share of elapsed months, rounded, so cents never drift.
+                principal_part = balance - (2 * total * (month - 1) + periods) // (2 * periods)
+            else:
+                principal_part = min(regular - interest_part, balance)
+            balance -= principal_part
+            payments.append(principal_part + interest_part)
+            interests.append(interest_part)
+            principals.append(principal_part)
+            balances.append(balance)
+        return cls(payments, interests, principals, balances)
+
+    def to_schedule(self):
+        """
+        Converts the schedule to an AmortizationSchedule in currency units.
+        """
+        return AmortizationSchedule(*(array('d', [cents / 100 for cents in column])
+                                      for column in (self.payment, self.interest, self.principal, self.balance)))
+
+    def total_paid(self):
+        """
+        Calculates the sum of all payments of the schedule.
+
+        Returns:
+        - Total amount paid over the loan period, in cents.
+        """
+        return sum(self.payment)
+
+
+def audit_schedule(loan_type, principal, periods, interest, tolerance=0.02):
+    """
+    Checks the floating point schedule of a loan against its exact schedule.
+
+    The regular payments of both must agree to within the tolerance, two cents by default since a payment adds a
+    principal and an interest part each rounded to the cent. The last payment and the total are reported but not
+    checked, since in cents the last payment settles the rounding of all earlier months.
+
+    Args:
+    - loan_type: 'annuity' or 'diff'.
+    - principal: Principal loan amount.
+    - periods: Number of monthly payments.
+    - interest: Annual interest in percent.
+    - tolerance: Largest difference allowed between two regular payments, in currency units.
+
+    Returns:
+    - Dictionary with the largest difference of the regular payments, the difference of the last payment and
+      of the total paid, and 'ok' telling if the schedules agree.
+    """
+    fast = AmortizationSchedule.build(loan_type, principal, periods, monthly_interest_rate(interest))
+    exact = ExactSchedule.build(loan_type, principal, periods, interest)
+    deviations = [abs(payment - cents / 100) for payment, cents in zip(fast.payment, exact.payment)]
+    regular = max(deviations[:-1], default=0.0)
+    return {'max_deviation': regular, 'last_payment_deviation': deviations[-1],
+            'total_paid_deviation': abs(fast.total_paid() - exact.total_paid() / 100),
+            'ok': regular <= tolerance}
+
+
+class LoanResult:
+    """
+    The solved loan returned by solve_loan().
+
+    Attributes:
+    - type: 'annuity' or 'diff'.
+    - solved: Name of the variable that was solved: 'payment', 'principal', 'periods' or 'interest'.
+    - principal, periods, interest, payment: Terms of the loan, including the solved one.
+      payment is None for a differentiated loan, whose payments change every month.
+    - payments: Monthly payments of a differentiated loan, None for an annuity.
+    - total_paid: Sum of all payments.
+    - overpayment: Total paid above the principal, rounded up.
+
+    Methods:
+    - schedule(): Builds the full amortization schedule of the loan.
+    - as_dict(): Returns the result as a dictionary of plain values.
+    """
+    FIELDS = ('type', 'solved', 'principal', 'periods', 'interest', 'payment', 'total_paid', 'overpayment')
+
+    def __init__(self, loan_type, solved, principal, periods, interest, payment, total_paid, payments=None):
+        self.type = loan_type
+        self.solved = solved
+        self.principal = principal
+        self.periods = periods
+        self.interest = interest
+        self.payment = payment
+        self.payments = payments
+        self.total_paid = total_paid
+        self.overpayment = math.ceil(total_paid - principal)
+
+    def schedule(self):
+        """
+        Builds the full amortization schedule of the loan terms.
+
+        Returns:
+        - AmortizationSchedule of the loan.
+        """
+        return AmortizationSchedule.build(self.type, self.principal, self.periods,
+                                          monthly_interest_rate(self.interest))
+
+    def as_dict(self):
+        """
+        Returns the result as a dictionary, the payments of a differentiated loan included if there are any.
+        """
+        result = {field: getattr(self, field) for field in self.FIELDS}
+        if self.payments is not None:
+            result['payments'] = self.payments
+        return result
+
+
+def solve_loan(loan_type, principal=None, periods=None, interest=None, payment=None):
+    """
+    Solves a loan for its missing variable without printing anything.
+
+    Exactly one of principal, periods, interest and payment must be None. Payments, principal and periods have
+    closed forms, the interest of an annuity is found numerically by annuity_interest(). A differentiated loan can
+    only be solved for its payments.
+
+    Args:
+    - loan_type: 'annuity' or 'diff'.
+    - principal: Principal loan amount.
+    - periods: Number of monthly payments.
+    - interest: Annual interest in percent.
+    - payment: Monthly payment.
+
+    Returns:
+    - LoanResult of the loan.
+
+    Raises:
+    - ValueError: If the parameters are incorrect or the loan cannot be solved.
+    """
+    if loan_type not in LOAN_TYPES or any(value is not None and value < 0
+                                          for value in (payment, principal, periods, interest)):
+        raise ValueError(INCORRECT_PARAMETERS)
+    try:
+        if payment is None and all([principal, periods, interest]):
+            interest_rate = monthly_interest_rate(interest)
+            if loan_type == 'diff':
+                payments = diff_payments(periods, principal, interest_rate)
+                return LoanResult(loan_type, 'payment', principal, periods, interest, None, sum(payments), payments)
+            payment = annuity_payment(periods, principal, interest_rate)
+            return LoanResult(loan_type, 'payment', principal, periods, interest, payment, payment * periods)
+        if principal is None and all([payment, periods, interest]):
+            principal = loan_principal(payment, periods, monthly_interest_rate(interest))
+            return LoanResult(loan_type, 'principal', principal, periods, interest, payment, payment * periods)
+        if periods is None and all([payment, principal, interest]):
+            periods = months_to_pay(payment, principal, monthly_interest_rate(interest))
+            return LoanResult(loan_type, 'periods', principal, periods, interest, payment, periods * payment)
+        if interest is None and loan_type == 'annuity' and all([payment, principal, periods]):
+            interest = annuity_interest(payment, principal, periods)
+            return LoanResult(loan_type, 'interest', principal, periods, interest, payment, payment * periods)
+    except ValueError as error:
+        if error.args == (PAYMENT_BELOW_INTEREST,):
+            raise  # Raised by months_to_pay(), the only error with a more precise message.
+    except (ZeroDivisionError, OverflowError):
+        pass
+    raise ValueError(INCORRECT_PARAMETERS)
+
+
+def solve_loans(loans):
+    """
+    Solves many loans for their missing variable, the interest of every annuity quote in one call of
+    annuity_interests() and the other loans with solve_loan().
+
+    Args:
+    - loans: List of (loan_type, principal, periods, interest, payment) tuples, the missing variable None.
+
+    Returns:
+    - List of the LoanResult of every loan, or of the ValueError of the loans that cannot be solved, in their order.
+    """
+    quotes = {index: (payment, principal, periods)
+              for index, (loan_type, principal, periods, interest, payment) in enumerate(loans)
+              if loan_type == 'annuity' and interest is None
+              and all(isinstance(value, (int, float)) and value > 0 for value in (payment, principal, periods))}
+    interests = dict(zip(quotes, annuity_interests(quotes.values())))
+    results = []
+    for index, loan in enumerate(loans):
+        if index in interests:
+            loan_type, principal, periods, _, payment = loan
+            if interests[index] is None:
+                results.append(ValueError(INCORRECT_PARAMETERS))
+            else:
+                results.append(LoanResult(loan_type, 'interest', principal, periods, interests[index], payment,
+                                          payment * periods))
+            continue
+        try:
+            results.append(solve_loan(*loan))
+        except ValueError as error:
+            results.append(error)
+        except TypeError:
+            results.append(ValueError(INCORRECT_PARAMETERS))
+    return results
+
+
+NORMAL_TABLE_SIZE = 1 << 16
+
+
+@lru_cache(maxsize=None)
+def _normal_table(size=NORMAL_TABLE_SIZE):
+    """
+    Returns the standard normal quantiles at size evenly spaced probabilities.
+
+    Drawing uniformly from the table samples the normal distribution to within 1 / size in probability, several
+    times faster than random.gauss() for every shock.
+    """
+    normal = statistics.NormalDist()
+    return tuple(normal.inv_cdf((index + 0.5) / size) for index in range(size))
+
+
+def _simulate_paths(loan_type, principal, periods, interest, volatility, reversion, paths, seed):
+    """
+    Simulates paths of a variable-rate loan and returns the overpayment of each, runs in the worker processes.
+
+    The annual interest follows a mean-reverting random walk around its starting value, floored at zero, and
+    moves every month. An annuity payment is recomputed every month over the remaining months at the new rate,
+    a differentiated loan repays a fixed principal part plus the interest at the new rate.
+
+    Returns:
+    - array('d') of the overpayment of every path.
+    """
+    choices = random.Random(seed).choices
+    step = volatility * math.sqrt(1 / 12)
+    shocks = [step * value for value in _normal_table()]
+    keep = 1 - reversion / 12
+    pull = interest * reversion / 12
+    principal_part = principal / periods
+    months = range(periods, 0, -1)
+    overpayments = array('d')
+    for _ in range(paths):
+        # The interest moves by reversion towards its start plus a normal shock: keep * annual + pull + shock.
+        annual = interest
+        balance = principal
+        total_paid = 0.0
+        if loan_type == 'diff':
+            for shock in choices(shocks, k=periods):
+                total_paid += balance * annual
+                balance -= principal_part
+                annual = keep * annual + pull + shock
+                if annual < 0.0:
+                    annual = 0.0
+            total_paid = principal + total_paid / 1200
+        else:
+            for remaining, shock in zip(months, choices(shocks, k=periods)):
+                rate = annual / 1200
+                if rate:
+                    payment = balance * rate / (1 - (1 + rate) ** -remaining)
+                    balance -= payment - balance * rate
+                else:
+                    payment = balance / remaining
+                    balance -= payment
+                total_paid += payment
+                annual = keep * annual + pull + shock
+                if annual < 0.0:
+                    annual = 0.0
+        overpayments.append(total_paid - principal)
+    return overpayments
+
+
+class SimulationResult:
+    """
+    The distribution of the overpayment over the simulated rate paths.
+
+    Attributes:
+    - paths: Number of simulated paths.
+    - mean, stdev, minimum, maximum: Statistics of the overpayment.
+    - percentiles: Dictionary of the overpayment at each percentile of PERCENTILES.
+    - fixed_overpayment: Overpayment if the rate never moved.
+
+    Methods:
+    - as_dict(): Returns the result as a dictionary of plain values.
+    - format(): Formats the result for printing.
+    """
+    PERCENTILES = (1, 5, 25, 50, 75, 95, 99)
+
+    def __init__(self, overpayments, fixed_overpayment):
+        self.paths = len(overpayments)
+        self.mean = statistics.fmean(overpayments)
+        self.stdev = statistics.stdev(overpayments) if self.paths > 1 else 0.0
+        self.minimum = min(overpayments)
+        self.maximum = max(overpayments)
+        cuts = statistics.quantiles(overpayments, n=100, method='inclusive') if self.paths > 1 \
+            else [overpayments[0]] * 99
+        self.percentiles = {percentile: cuts[percentile - 1] for percentile in self.PERCENTILES}
+        self.fixed_overpayment = fixed_overpayment
+
+    def as_dict(self):
+        """
+        Returns the result as a dictionary of plain values.
+        """
+        return {'paths': self.paths, 'mean': self.mean, 'stdev': self.stdev, 'min': self.minimum,
+                'max': self.maximum, 'fixed_overpayment': self.fixed_overpayment,
+                'percentiles': {f'p{percentile}': value for percentile, value in self.percentiles.items()}}
+
+    def format(self):
+        """
+        Formats the result, one statistic of the overpayment per line.
+        """
+        lines = [f'Simulated paths: {self.paths}',
+                 f'Overpayment at a fixed rate: {math.ceil(self.fixed_overpayment)}',
+                 f'Mean overpayment: {math.ceil(self.mean)}',
+                 f'Standard deviation: {math.ceil(self.stdev)}',
+                 f'Minimum: {math.ceil(self.minimum)}, maximum: {math.ceil(self.maximum)}']
+        lines.extend(f'P{percentile}: {math.ceil(value)}' for percentile, value in self.percentiles.items())
+        return '\n'.join(lines)
+
+
+class RateScenarioSimulator:
+    """
+    A Monte Carlo simulator of variable-rate loans, spreading the rate paths over a pool of processes.
+
+    Attributes:
+    - volatility: Standard deviation of the annual interest over a year, in percentage points.
+    - reversion: Speed at which the interest is pulled back to its starting value, per year.
+    - workers: Number of processes, the number of CPUs if None.
+    - chunk_size: Number of paths simulated by a process at a time.
+
+    Methods:
+    - __call__(): Simulates the paths of a loan and returns the distribution of its overpayment.
+    """
+    CHUNK_SIZE = 10000
+
+    def __init__(self, volatility=1.0, reversion=0.0, workers=None, chunk_size=None):
+        self.volatility = volatility
+        self.reversion = reversion
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+
+    def __call__(self, loan_type, principal, periods, interest, paths, seed=None):
+        """
+        Simulates the rate paths of a loan.
+
+        Args:
+        - loan_type: 'annuity' or 'diff'.
+        - principal: Principal loan amount.
+        - periods: Number of monthly payments.
+        - interest: Starting annual interest in percent.
+        - paths: Number of rate paths to simulate.
+        - seed: Seed making the simulation reproducible, for the same number of paths and chunk size.
+
+        Returns:
+        - SimulationResult of the simulated overpayments.
+
+        Raises:
+        - ValueError: If the parameters are incorrect.
+        """
+        if loan_type not in LOAN_TYPES or not all([principal, periods, paths]) or min(principal, periods, paths) < 0 \
+                or interest is None or interest < 0 or self.volatility < 0:
+            raise ValueError(INCORRECT_PARAMETERS)
+        seeds = random.Random(seed)
+        chunks = [(loan_type, principal, periods, interest, self.volatility, self.reversion,
+                   min(self.chunk_size, paths - start), seeds.getrandbits(64))
+                  for start in range(0, paths, self.chunk_size)]
+        overpayments = array('d')
+        if self.workers == 1 or len(chunks) == 1:
+            for chunk in chunks:
+                overpayments.extend(_simulate_paths(*chunk))
+        else:
+            with ProcessPoolExecutor(min(self.workers, len(chunks))) as executor:
+                for result in executor.map(_simulate_paths, *zip(*chunks)):
+                    overpayments.extend(result)
+        fixed = _simulate_paths(loan_type, principal, periods, interest, 0.0, 0.0, 1, 0)[0]
+        return SimulationResult(overpayments, fixed)
 
 
 class LoanCalculator:
     """
-    A class to calculate loan-related information based on user input.
+    A command line wrapper over solve_loan() that prints loan-related information based on user input.
 
     Attributes:
     - args: Holds the parsed arguments from user input.
@@ -13,39 +906,48 @@ class LoanCalculator:
     Methods:
     - parse_arguments(): Parses the user input arguments using argparse.
     - validate_arguments(): Validates the user input arguments for correctness.
-    - calculate_user_input(): Determines the type of calculation based on user input.
-    - calculate_months_to_pay(): Calculates the number of months to repay the loan.
-    - calculate_monthly_payment(): Calculates the monthly payment amount.
-    - calculate_diff_payment(): Calculates the differentiated payment schedule.
-    - calculate_annuity_payment(): Calculates the annuity payment amount.
-    - calculate_loan_principal(): Calculates the loan principal amount.
-    - interest_rate(): Calculates the monthly interest rate.
+    - calculate_user_input(): Solves the loan of the user input and prints the result.
+    - format_result(): Formats a LoanResult the way the command line prints it.
     - print_months_to_pay(): Formats the output for months to repay the loan.
-    - calculate_overpayment(): Calculates the overpayment amount.
+    - calculate_overpayment(): Formats the overpayment amount.
+    - calculate_batch(): Solves every loan of a CSV or JSONL file and writes the results as CSV.
+    - calculate_simulation(): Simulates variable rates for the loan and prints the distribution of its overpayment.
 
+    With --schedule the full amortization schedule, built by AmortizationSchedule, follows the monthly payment.
     """
     # Example of user_input: --type=diff --principal=1000000 --periods=10 --interest=10
     # put as entry arguments
 
     args = None
     VALID_ARGUMENTS = ['payment', 'principal', 'periods', 'interest']
+    BATCH_COLUMNS = ['type', 'principal', 'periods', 'interest', 'payment', 'total_paid', 'overpayment', 'error']
+    AUDIT_COLUMNS = ['max_deviation', 'audit']
+    BATCH_CHUNK = 1024
 
-    def __init__(self):
-        self.args = self.parse_arguments()
+    def __init__(self, args=None):
+        self.args = args if args is not None else self.parse_arguments()
         self.validate_arguments()
         self.initialize_loan_calculation()
 
     def initialize_loan_calculation(self):
         """
-        Method to calculate the user input for loan calculation.
+        Method to calculate the user input for loan calculation, or every loan of the batch file.
         """
-        self.calculate_user_input()
+        if self.args.batch:
+            self.calculate_batch()
+        elif self.args.simulate:
+            self.calculate_simulation()
+        else:
+            self.calculate_user_input()
 
     @staticmethod
-    def parse_arguments():
+    def parse_arguments(argv=None):
         """
         Parses the user input arguments using argparse.
 
+        Args:
+        - argv: Arguments to parse, the command line arguments if None.
+
         Returns:
         - Parsed arguments from user input.
         """
@@ -55,128 +957,237 @@ class LoanCalculator:
         parser.add_argument('--periods', type=int)
         parser.add_argument('--interest', type=float)
         parser.add_argument('--type')
-        return parser.parse_args()
+        parser.add_argument('--schedule', action='store_true', help='also print the full amortization schedule')
+        parser.add_argument('--batch', help='CSV or JSONL file of loans to solve, "-" reads CSV from stdin')
+        parser.add_argument('--output', help='CSV file the batch results are written to, stdout if not set')
+        parser.add_argument('--prepay', action='append', type=Prepayment.parse, default=[],
+                            metavar='MONTH:AMOUNT[:MODE]',
+                            help='extra payment in a month, reducing the term, or the payment with MODE "payment"')
+        parser.add_argument('--exact', action='store_true',
+                            help='print the schedule of --schedule rounded to the cent with exact arithmetic')
+        parser.add_argument('--audit', action='store_true',
+                            help='check the schedule of every batch loan solved for its payment against the exact one')
+        parser.add_argument('--simulate', type=int, metavar='PATHS',
+                            help='simulate this many variable-rate paths of the loan instead of solving it')
+        parser.add_argument('--volatility', type=float, default=1.0,
+                            help='yearly standard deviation of the simulated interest, in percentage points')
+        parser.add_argument('--reversion', type=float, default=0.0,
+                            help='yearly speed at which the simulated interest returns to --interest')
+        parser.add_argument('--seed', type=int, help='seed of the simulation')
+        parser.add_argument('--workers', type=int, help='processes of the simulation, the number of CPUs by default')
+        return parser.parse_args(argv)
 
     def validate_arguments(self):
         """
         Validates the user input arguments for correctness.
         Exits the program if parameters are incorrect.
+        In batch mode every row is validated on its own instead.
         """
-        if self.args.type not in ["annuity", "diff"]:
-            exit(print("Incorrect parameters"))
+        if self.args.batch:
+            return
+        if self.args.type not in LOAN_TYPES:
+            exit(print(INCORRECT_PARAMETERS))
 
         for argument in self.VALID_ARGUMENTS:
             value = getattr(self.args, argument)
             if value is not None and value < 0:
-                exit(print("Incorrect parameters"))
+                exit(print(INCORRECT_PARAMETERS))
 
     def calculate_user_input(self):
         """
-        Determines the type of calculation based on user input.
+        Solves the loan of the user input for its missing variable and prints the result.
         """
-        if self.args.payment is None:
-            if all([self.args.principal, self.args.periods, self.args.interest]):
-                self.calculate_monthly_payment()
+        try:
+            result = solve_loan(self.args.type, self.args.principal, self.args.periods, self.args.interest,
+                                self.args.payment)
+        except ValueError as error:
+            print(error)
+            return
+        print(self.format_result(result))
+        if self.args.prepay and result.solved == 'payment':
+            try:
+                schedule = result.schedule().with_prepayments(self.args.prepay)
+            except ValueError as error:
+                print(error)
                 return
-        elif self.args.principal is None:
-            if all([self.args.payment, self.args.periods, self.args.interest]):
-                self.calculate_loan_principal()
-                return
-        elif self.args.periods is None:
-            if all([self.args.payment, self.args.principal, self.args.interest]):
-                self.calculate_months_to_pay()
-                return
-
-        print("Incorrect parameters")
+            print(self.format_prepaid(schedule, result))
+            if self.args.schedule:
+                print()
+                print(schedule.format())
+        elif self.args.schedule and result.solved == 'payment':
+            print()
+            if self.args.exact:
+                print(ExactSchedule.build(result.type, result.principal, result.periods,
+                                          result.interest).to_schedule().format())
+            else:
+                print(result.schedule().format())
 
-    def calculate_months_to_pay(self):
+    def calculate_simulation(self):
         """
-        Calculates the number of months to repay the loan.
+        Simulates variable rates for the loan of the user input and prints the distribution of its overpayment.
         """
-        payment = self.args.payment
-        principal = self.args.principal
-        interest_rate = self.interest_rate()
+        simulator = RateScenarioSimulator(self.args.volatility, self.args.reversion, self.args.workers)
+        try:
+            result = simulator(self.args.type, self.args.principal, self.args.periods, self.args.interest,
+                               self.args.simulate, self.args.seed)
+        except ValueError as error:
+            print(error)
+            return
+        print(result.format())
 
-        months_amount = math.ceil(math.log(payment / (payment - interest_rate * principal), 1 + interest_rate))
+    @classmethod
+    def format_result(cls, result):
+        """
+        Formats a LoanResult the way the command line prints it.
 
-        years, months = divmod(months_amount, 12)
+        Args:
+        - result: The LoanResult to format.
 
-        total_paid = months_amount * payment
+        Returns:
+        - The lines describing the solved variable, followed by the overpayment.
+        """
+        if result.solved == 'periods':
+            years, months = divmod(result.periods, 12)
+            lines = [cls.print_months_to_pay(years, months)]
+        elif result.solved == 'principal':
+            lines = [f'Your loan principal = {result.principal}!']
+        elif result.solved == 'interest':
+            lines = [f'Your loan interest = {result.interest:.2f}%!']
+        elif result.payments is not None:
+            lines = [f'Month {month + 1}: payment is {payment}' for month, payment in enumerate(result.payments)]
+            lines.append('')
+        else:
+            lines = [f'Your monthly payment = {result.payment}!']
+        lines.append(cls.calculate_overpayment(result.total_paid, result.principal))
+        return '\n'.join(lines)
 
-        if months > 0:
-            years += months // 12
-            months %= 12
+    @classmethod
+    def format_prepaid(cls, schedule, result):
+        """
+        Formats the outcome of the prepayments of a loan.
 
-        print(self.print_months_to_pay(years, months))
-        print(self.calculate_overpayment(total_paid, principal))
+        Args:
+        - schedule: The schedule with the prepayments applied.
+        - result: The LoanResult of the loan without them.
 
-    def calculate_monthly_payment(self):
-        """
-        Calculates the monthly payment amount.
+        Returns:
+        - The time to repay the loan and the overpayment with the prepayments.
+
+        The schedules are not rounded to whole payments like the overpayment of the result, so the overpayment with
+        the prepayments is that of the result less what the prepayments save on the schedule, and the two compare.
         """
-        principal = self.args.principal
-        periods = self.args.periods
-        interest_rate = self.interest_rate()
-        type_of_payment = self.args.type
-        total_paid = 0
+        saved = result.schedule().total_paid() - schedule.total_paid()
+        return '\n'.join(['With prepayments:', cls.print_months_to_pay(*divmod(len(schedule), 12)),
+                          cls.calculate_overpayment(result.total_paid - saved, result.principal)])
 
-        if type_of_payment == 'diff':
-            total_paid = self.calculate_diff_payment(periods, principal, interest_rate)
-        elif type_of_payment == 'annuity':
-            total_paid = self.calculate_annuity_payment(periods, principal, interest_rate)
+    def calculate_batch(self):
+        """
+        Solves every loan of the batch file for its missing variable and writes the results as CSV.
 
-        print(self.calculate_overpayment(total_paid, principal))
+        The loans are read and the results written BATCH_CHUNK rows at a time, so the file is never held in memory,
+        and the rows of a chunk are solved together by solve_loans().
+        A row that cannot be solved is written with its error instead of stopping the batch.
+        """
+        output = open(self.args.output, 'w', newline='') if self.args.output else sys.stdout
+        try:
+            columns = self.BATCH_COLUMNS + (self.AUDIT_COLUMNS if self.args.audit else [])
+            writer = csv.DictWriter(output, columns, extrasaction='ignore')
+            writer.writeheader()
+            loans = self.read_loans(self.args.batch)
+            while chunk := list(islice(loans, self.BATCH_CHUNK)):
+                writer.writerows(self.solve_rows(chunk, self.args.audit))
+        finally:
+            if output is not sys.stdout:
+                output.close()
 
     @staticmethod
-    def calculate_diff_payment(periods, principal, interest_rate):
+    def read_loans(path):
         """
-        Calculates the differentiated payment schedule.
+        Reads the loans of a CSV file with a header row, or of a JSONL file if its name ends with .jsonl.
+
+        Args:
+        - path: Path of the file, '-' reads CSV from stdin.
+
+        Returns:
+        - Iterator of dictionaries with the type, principal, periods, interest and payment of every loan.
+          A JSONL line that is not valid JSON is yielded as it is, so that solve_rows() reports it as an error.
         """
-        total_paid = 0
-        for month in range(0, periods):
-            result = math.ceil(
-                round(principal / periods + interest_rate * (principal - ((principal * month - 1) / periods)),
-                      2))
-            total_paid += result
-            print(f'Month {month + 1}: payment is {result}')
-        print()
-        return total_paid
+        file = sys.stdin if path == '-' else open(path, newline='')
+        try:
+            if path.endswith('.jsonl'):
+                for line in file:
+                    if line.strip():
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            yield line.strip()
+            else:
+                yield from csv.DictReader(file)
+        finally:
+            if file is not sys.stdin:
+                file.close()
 
-    @staticmethod
-    def calculate_annuity_payment(periods, principal, interest_rate):
+    @classmethod
+    def solve_row(cls, loan, audit=False):
         """
-        Calculates the annuity payment amount.
+        Solves one loan of a batch file, see solve_rows().
         """
-        result = math.ceil(principal * (interest_rate * pow(1 + interest_rate, periods)) / (
-                pow(1 + interest_rate, periods) - 1))
-        total_paid = result * periods
-        print(f'Your monthly payment = {result}!')
-        return total_paid
+        return cls.solve_rows([loan], audit)[0]
 
-    def calculate_loan_principal(self):
+    @classmethod
+    def solve_rows(cls, loans, audit=False):
         """
-        Calculates the loan principal amount based on user input.
+        Solves a chunk of loans of a batch file together with solve_loans().
 
-        Prints the loan principal and overpayment information.
+        Args:
+        - loans: List of dictionaries with the type, principal, periods, interest and payment, missing values None
+          or ''.
+        - audit: If True, the schedule of a loan solved for its payment is checked with audit_schedule().
+
+        Returns:
+        - List of dictionaries of the loans with the missing variable, the total paid and the overpayment filled in,
+          or with the error if a loan cannot be solved or is not a dictionary at all.
         """
-        payments = self.args.payment
-        periods = self.args.periods
-        interest_rate = self.interest_rate()
-        principal = math.floor(payments / (interest_rate * pow(1 + interest_rate, periods) / (
-                pow(1 + interest_rate, periods) - 1)))
-        total_loan = payments * periods
-        print(f'Your loan principal = {principal}!')
-        print(self.calculate_overpayment(total_loan, principal))
+        terms = [cls._batch_terms(loan) for loan in loans]
+        results = iter(solve_loans([loan_terms for loan_terms in terms if loan_terms is not None]))
+        rows = []
+        for loan, loan_terms in zip(loans, terms):
+            result = next(results) if loan_terms is not None else None
+            if not isinstance(result, LoanResult):
+                rows.append(dict(loan, error=INCORRECT_PARAMETERS) if isinstance(loan, dict)
+                            else {'error': INCORRECT_PARAMETERS})
+                continue
+            solved = getattr(result, result.solved)
+            row = dict(loan, **{result.solved: '' if solved is None else solved}, total_paid=result.total_paid,
+                       overpayment=result.overpayment)
+            if audit and result.solved == 'payment':
+                report = audit_schedule(result.type, result.principal, result.periods, result.interest)
+                row.update(max_deviation=f'{report["max_deviation"]:.6f}', audit='ok' if report['ok'] else 'mismatch')
+            rows.append(row)
+        return rows
 
-    def interest_rate(self):
+    @classmethod
+    def _batch_terms(cls, loan):
         """
-        Calculates the monthly interest rate based on the user input.
+        Converts a loan of a batch file to the arguments of solve_loan(), None if its values are not numbers.
+        """
+        if not isinstance(loan, dict):
+            return None
+        try:
+            values = {argument: cls._batch_value(loan.get(argument), int if argument in ('principal', 'periods')
+                                                 else float) for argument in cls.VALID_ARGUMENTS}
+        except (ValueError, TypeError, OverflowError):
+            return None
+        return loan.get('type'), values['principal'], values['periods'], values['interest'], values['payment']
 
-        Returns:
-        - Monthly interest rate.
+    @staticmethod
+    def _batch_value(value, number_type):
+        """
+        Converts a value of a batch row to a number, None if it is missing.
         """
-        interest = self.args.interest
-        return interest / (12 * 100)
+        if value is None or value == '':
+            return None
+        return number_type(float(value)) if number_type is int else number_type(value)
 
     @staticmethod
     def print_months_to_pay(years, months):
@@ -0,0 +1,324 @@
+import argparse
+import cProfile
+import io
+import json
+import os
+import platform
+import pstats
+import random
+import statistics
+import time
+import timeit
+
+from loan_calculator import AmortizationSchedule, ExactSchedule, annuity_factor, annuity_interest, \
+    annuity_interests, annuity_payment, audit_schedule, diff_payments, loan_principal, monthly_interest_rate, \
+    months_to_pay, solve_loan
+
+
+class Profiler:
+    """
+    A cProfile hook the benchmarks call with every case they time.
+
+    Attributes:
+    - directory: Directory the profile of every case is saved to as <case>.prof, not saved if None.
+    - top: Number of functions of every profile printed, sorted by cumulative time.
+
+    Methods:
+    - __call__(): Profiles a case and returns the report of its most expensive functions.
+    """
+    def __init__(self, directory=None, top=10):
+        self.directory = directory
+        self.top = top
+        self.reports = []
+
+    def __call__(self, name, run):
+        """
+        Profiles one run of a case.
+
+        Args:
+        - name: Name of the case.
+        - run: Callable running the case.
+
+        Returns:
+        - The report of the case, also kept in reports.
+        """
+        profiler = cProfile.Profile()
+        profiler.runcall(run)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.directory, name.replace(' ', '_') + '.prof'))
+        output = io.StringIO()
+        pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(self.top)
+        report = f'== {name}\n{output.getvalue().strip()}'
+        self.reports.append(report)
+        return report
+
+
+class LoanBenchmark:
+    """
+    Times the ways LoanCalculator can build the schedules of a portfolio of loans.
+
+    Attributes:
+    - loans: List of (loan_type, principal, periods, interest) tuples the modes run on.
+    - repeat: Number of timed runs of every mode.
+
+    Methods:
+    - modes(): Returns the benchmarked modes.
+    - __call__(): Runs the modes and returns their timings.
+    - table(): Formats the timings as a table.
+    - details(): Returns the parameters of the run.
+    """
+    RATES = (3.5, 4.0, 4.5, 5.0, 5.5, 6.0, 6.5, 7.0)
+
+    def __init__(self, loans=1000, periods=360, repeat=3, seed=0):
+        rng = random.Random(seed)
+        self.loans = [(rng.choice(('annuity', 'diff')), rng.randint(50000, 1000000), periods, rng.choice(self.RATES))
+                      for _ in range(loans)]
+        self.periods = periods
+        self.repeat = repeat
+
+    def modes(self):
+        """
+        Returns the benchmarked modes.
+
+        Returns:
+        - List of (name, callable) pairs, each callable building the schedules of all loans.
+        """
+        loans = self.loans
+        return [
+            ('float schedule', lambda: [AmortizationSchedule.build(loan_type, principal, periods,
+                                                                   monthly_interest_rate(interest))
+                                        for loan_type, principal, periods, interest in loans]),
+            ('float shared terms', lambda: AmortizationSchedule.build_many(
+                (loan_type, principal, periods, monthly_interest_rate(interest))
+                for loan_type, principal, periods, interest in loans)),
+            ('exact cents', lambda: [ExactSchedule.build(*loan) for loan in loans]),
+            ('audit', lambda: [audit_schedule(*loan) for loan in loans]),
+            ('diff payments', lambda: [diff_payments(periods, principal, monthly_interest_rate(interest))
+                                       for _, principal, periods, interest in loans]),
+        ]
+
+    def __call__(self, names=None, profiler=None):
+        """
+        Runs the modes, or only those whose name contains one of names.
+
+        Args:
+        - names: Parts of the names of the modes to run, all modes if empty.
+        - profiler: Callable given the name and callable of every mode after it is timed, such as a Profiler.
+
+        Returns:
+        - List of dictionaries with the timings of every mode, per schedule and relative to the float schedule.
+        """
+        results = []
+        for name, run in self.modes():
+            if names and not any(part in name for part in names):
+                continue
+            samples = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                run()
+                samples.append(time.perf_counter() - start)
+            if profiler:
+                profiler(name, run)
+            results.append({'mode': name, 'schedules': len(self.loans), 'runs': self.repeat,
+                            'mean_ms': statistics.mean(samples) * 1000, 'min_ms': min(samples) * 1000,
+                            'per_schedule_us': min(samples) / len(self.loans) * 1e6})
+        baseline = next((result['min_ms'] for result in results if result['mode'] == 'float schedule'), None)
+        for result in results:
+            result['relative'] = result['min_ms'] / baseline if baseline else None
+        return results
+
+    @staticmethod
+    def table(results):
+        """
+        Formats the timings as a table, one line per mode.
+        """
+        lines = [f'{"mode":<20}{"schedules":>10}{"mean ms":>12}{"min ms":>12}{"us/schedule":>14}{"relative":>10}']
+        for result in results:
+            relative = f'{result["relative"]:.2f}x' if result['relative'] else '-'
+            lines.append(f'{result["mode"]:<20}{result["schedules"]:>10}{result["mean_ms"]:>12.1f}'
+                         f'{result["min_ms"]:>12.1f}{result["per_schedule_us"]:>14.1f}{relative:>10}')
+        return '\n'.join(lines)
+
+    def details(self):
+        """
+        Returns the parameters of the run, recorded with its results.
+        """
+        return {'loans': len(self.loans), 'periods': self.periods, 'repeat': self.repeat}
+
+
+class FormulaBenchmark:
+    """
+    Times every formula of the loan calculator for scalar calls, large batches and long schedules.
+
+    Attributes:
+    - batch: Number of quotes of the batch cases.
+    - repeat: Number of timed runs of the batch and schedule cases, scalar calls are repeated by timeit.
+    - quotes: Generated (periods, principal, monthly rate, payment) quotes of the batch cases.
+
+    Methods:
+    - cases(): Returns the benchmarked cases.
+    - __call__(): Runs the cases and returns their timings.
+    - table(): Formats the timings as a table.
+    """
+    PERIODS = (12, 120, 360, 600)
+    RATES = LoanBenchmark.RATES
+
+    def __init__(self, batch=10000, repeat=3, seed=0):
+        rng = random.Random(seed)
+        self.batch = batch
+        self.repeat = repeat
+        self.quotes = []
+        for _ in range(batch):
+            periods, principal = rng.choice(self.PERIODS), rng.randint(50000, 1000000)
+            rate = monthly_interest_rate(rng.choice(self.RATES))
+            self.quotes.append((periods, principal, rate, annuity_payment(periods, principal, rate)))
+        self.distinct_rates = [monthly_interest_rate(rng.uniform(1, 20)) for _ in range(batch)]
+
+    def cases(self):
+        """
+        Returns the benchmarked cases.
+
+        Returns:
+        - List of (name, kind, callable, operations) tuples, kind being 'scalar', 'batch' or 'schedule' and
+          operations the number of formula calls made by one call of the callable.
+        """
+        quotes, rates = self.quotes, self.distinct_rates
+        rate = monthly_interest_rate(6)
+
+        def uncached_payments():
+            # Every rate is new to the annuity factor cache, so this measures the cost of a miss.
+            annuity_factor.cache_clear()
+            return [annuity_payment(quote[0], quote[1], rate) for quote, rate in zip(quotes, rates)]
+
+        cases = [
+            ('annuity_payment', 'scalar', lambda: annuity_payment(360, 300000, rate), 1),
+            ('loan_principal', 'scalar', lambda: loan_principal(1799, 360, rate), 1),
+            ('months_to_pay', 'scalar', lambda: months_to_pay(1799, 300000, rate), 1),
+            ('annuity_interest', 'scalar', lambda: annuity_interest(1799, 300000, 360), 1),
+            ('solve_loan', 'scalar', lambda: solve_loan('annuity', 300000, 360, 6), 1),
+            ('annuity_payment', 'batch',
+             lambda: [annuity_payment(periods, principal, rate) for periods, principal, rate, _ in quotes],
+             len(quotes)),
+            ('annuity_payment distinct rates', 'batch', uncached_payments, len(quotes)),
+            ('loan_principal', 'batch',
+             lambda: [loan_principal(payment, periods, rate) for periods, _, rate, payment in quotes], len(quotes)),
+            ('months_to_pay', 'batch',
+             lambda: [months_to_pay(payment, principal, rate) for _, principal, rate, payment in quotes], len(quotes)),
+            ('annuity_interests', 'batch',
+             lambda: annuity_interests([(payment, principal, periods) for periods, principal, _, payment in quotes]),
+             len(quotes)),
+        ]
+        for periods in self.PERIODS:
+            cases.extend([
+                (f'diff_payments {periods}', 'schedule',
+                 lambda periods=periods: diff_payments(periods, 300000, rate), 1),
+                (f'float schedule {periods}', 'schedule',
+                 lambda periods=periods: AmortizationSchedule.build('annuity', 300000, periods, rate), 1),
+                (f'exact schedule {periods}', 'schedule',
+                 lambda periods=periods: ExactSchedule.build('annuity', 300000, periods, 6), 1),
+            ])
+        return cases
+
+    def __call__(self, names=None, profiler=None):
+        """
+        Runs the cases, or only those whose name contains one of names.
+
+        Args:
+        - names: Parts of the names of the cases to run, all cases if empty.
+        - profiler: Callable given the name and callable of every case after it is timed, such as a Profiler.
+
+        Returns:
+        - List of dictionaries with the timings of every case, per formula call.
+        """
+        results = []
+        for name, kind, run, operations in self.cases():
+            if names and not any(part in name for part in names):
+                continue
+            annuity_factor.cache_clear()
+            if kind == 'scalar':
+                timer = timeit.Timer(run)
+                number, _ = timer.autorange()
+                best = min(timer.repeat(self.repeat, number)) / number
+            else:
+                best = min(timeit.repeat(run, number=1, repeat=self.repeat))
+            if profiler:
+                profiler(f'{kind} {name}', run)
+            results.append({'case': name, 'kind': kind, 'operations': operations, 'best_ms': best * 1000,
+                            'per_call_us': best / operations * 1e6})
+        return results
+
+    @staticmethod
+    def table(results):
+        """
+        Formats the timings as a table, one line per case.
+        """
+        lines = [f'{"case":<32}{"kind":<10}{"calls":>8}{"best ms":>12}{"us/call":>12}']
+        for result in results:
+            lines.append(f'{result["case"]:<32}{result["kind"]:<10}{result["operations"]:>8}'
+                         f'{result["best_ms"]:>12.3f}{result["per_call_us"]:>12.3f}')
+        return '\n'.join(lines)
+
+
+def to_json(results, details):
+    """
+    Returns the results of the suites with the details of the run as JSON.
+
+    Args:
+    - results: Dictionary of the results of every suite that ran.
+    - details: Dictionary of the parameters of the run.
+    """
+    return json.dumps({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                       'platform': platform.platform(), **details, 'results': results}, indent=2)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments of the benchmark.
+
+    Returns:
+    - Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Benchmarks the formulas and schedule modes of the loan calculator.')
+    parser.add_argument('modes', nargs='*', help='run only the modes and cases whose name contains one of these')
+    parser.add_argument('--suite', choices=('all', 'schedules', 'formulas'), default='all', help='suites to run')
+    parser.add_argument('--loans', type=int, default=1000, help='number of loans in the portfolio')
+    parser.add_argument('--periods', type=int, default=360, help='months of every loan')
+    parser.add_argument('--batch', type=int, default=10000, help='number of quotes of the formula batches')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of every mode')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated portfolio')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--profile', action='store_true', help='profile every case with cProfile after timing it')
+    parser.add_argument('--profile-dir', help='save the profile of every case to a .prof file in this directory')
+    parser.add_argument('--top', type=int, default=10, help='functions printed of every profile')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main function to run the benchmark and print its results.
+    """
+    args = parse_arguments()
+    profiler = Profiler(args.profile_dir, args.top) if args.profile or args.profile_dir else None
+    results, details = {}, {'repeat': args.repeat, 'seed': args.seed}
+    if args.suite in ('all', 'schedules'):
+        benchmark = LoanBenchmark(args.loans, args.periods, args.repeat, args.seed)
+        results['schedules'] = benchmark(args.modes, profiler)
+        details.update(benchmark.details())
+        if results['schedules']:
+            print(benchmark.table(results['schedules']))
+    if args.suite in ('all', 'formulas'):
+        benchmark = FormulaBenchmark(args.batch, args.repeat, args.seed)
+        results['formulas'] = benchmark(args.modes, profiler)
+        details['batch'] = args.batch
+        if results['formulas']:
+            print(benchmark.table(results['formulas']))
+    if profiler:
+        print('\n\n'.join(profiler.reports))
+    if args.json:
+        with open(args.json, 'w') as file:
+            file.write(to_json(results, details))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+from http import HTTPStatus
+
+from loan_calculator import INCORRECT_PARAMETERS, LoanResult, annuity_factor, solve_loans
+
+
+MAX_PERIODS = 1200
+TOO_MANY_PERIODS = f'At most {MAX_PERIODS} periods are accepted'
+INTERNAL_ERROR = HTTPStatus.INTERNAL_SERVER_ERROR.phrase
+
+
+def solve_batch(loans):
+    """
+    Solves a batch of loans with one call of solve_loans(), identical loans of the batch are solved only once.
+
+    The batch is solved on the event loop, so loans of more than MAX_PERIODS periods, whose differentiated payments
+    would hold up every connection, are answered with an error instead.
+
+    Args:
+    - loans: List of dictionaries with the type, principal, periods, interest and payment of every loan.
+
+    Returns:
+    - List of the results as dictionaries, with an 'error' key for the loans that cannot be solved.
+    """
+    keys = []
+    for loan in loans:
+        key = tuple(loan.get(name) for name in ('type', 'principal', 'periods', 'interest', 'payment')) \
+            if isinstance(loan, dict) else None
+        try:
+            hash(key)
+        except TypeError:
+            key = None  # A list or object given as a value.
+        keys.append(key)
+    distinct = list(dict.fromkeys(key for key in keys if key is not None))
+    too_long = [key for key in distinct if isinstance(key[2], (int, float)) and key[2] > MAX_PERIODS]
+    distinct = [key for key in distinct if key not in too_long]
+    solved = {key: result.as_dict() if isinstance(result, LoanResult) else {'error': str(result)}
+              for key, result in zip(distinct, solve_loans(distinct))}
+    solved.update((key, {'error': TOO_MANY_PERIODS}) for key in too_long)
+    return [solved[key] if key is not None else {'error': INCORRECT_PARAMETERS} for key in keys]
+
+
+class MicroBatcher:
+    """
+    Collects the loans of concurrent requests and solves them together.
+
+    The first loan to arrive opens a batch, which is solved once the window has passed or it holds max_batch loans,
+    so requests arriving within a few milliseconds of each other share a single call of solve_batch().
+
+    Attributes:
+    - window: Seconds a batch stays open.
+    - max_batch: Number of loans at which a batch is solved at once.
+    - batches, batched: Number of batches solved and of loans in them.
+
+    Methods:
+    - solve(): Adds loans to the current batch and waits for their results.
+    - run(): Solves the batches, runs until cancelled.
+
+    If solving a batch fails unexpectedly, every request of the batch is answered with INTERNAL_ERROR and the
+    batching goes on.
+    """
+    def __init__(self, window=0.002, max_batch=512):
+        self.window = window
+        self.max_batch = max_batch
+        self.batches = 0
+        self.batched = 0
+        self._queue = asyncio.Queue()
+
+    async def solve(self, loans):
+        """
+        Adds loans to the current batch.
+
+        Args:
+        - loans: List of loan dictionaries.
+
+        Returns:
+        - List of their results, in the same order.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((loans, future))
+        return await future
+
+    async def run(self):
+        """
+        Solves the batches as they fill up, runs until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self._queue.get()]
+            size = len(requests[0][0])
+            deadline = loop.time() + self.window
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                size += len(request[0])
+            try:
+                results = solve_batch([loan for loans, _ in requests for loan in loans])
+            except Exception as error:
+                # A loan the solver does not expect must not end the batching, or no request would be answered.
+                results = [{'error': INTERNAL_ERROR, 'detail': str(error)}] * size
+            self.batches += 1
+            self.batched += size
+            start = 0
+            for loans, future in requests:
+                if not future.done():
+                    future.set_result(results[start:start + len(loans)])
+                start += len(loans)
+
+
+class ServiceStats:
+    """
+    Latency and throughput of the service.
+
+    Attributes:
+    - started: Time the service started, from time.monotonic().
+    - requests, errors: Number of requests answered and of those answered with an error.
+    - latencies: Latencies of the most recent requests in seconds.
+
+    Methods:
+    - record(): Records an answered request.
+    - as_dict(): Returns the statistics as a dictionary.
+    """
+    SAMPLES = 10000
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=self.SAMPLES)
+
+    def record(self, latency, error=False):
+        """
+        Records an answered request.
+
+        Args:
+        - latency: Seconds from reading the request to writing its response.
+        - error: True if the request was answered with an error.
+        """
+        self.requests += 1
+        self.errors += error
+        self.latencies.append(latency)
+
+    def as_dict(self, batcher):
+        """
+        Returns the statistics, including those of the batcher and of the annuity factor cache.
+
+        Args:
+        - batcher: The MicroBatcher of the service.
+
+        Returns:
+        - Dictionary of the statistics, latencies in milliseconds.
+        """
+        uptime = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000 if latencies else None
+
+        cache = annuity_factor.cache_info()
+        return {'uptime_s': uptime, 'requests': self.requests, 'errors': self.errors,
+                'requests_per_s': self.requests / uptime if uptime else 0.0,
+                'latency_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99),
+                               'max': latencies[-1] * 1000 if latencies else None},
+                'batches': batcher.batches,
+                'mean_batch_size': batcher.batched / batcher.batches if batcher.batches else 0.0,
+                'annuity_factor_cache': {'hits': cache.hits, 'misses': cache.misses, 'size': cache.currsize}}
+
+
+class LoanService:
+    """
+    An HTTP/JSON service solving loans with solve_loans(), one process serving many concurrent clients.
+
+    Endpoints:
+    - POST /solve: Solves the loan of a JSON object, or every loan of a JSON list, and returns the results.
+    - GET /stats: Returns the latency and throughput statistics.
+
+    Connections are kept alive between requests unless the client asks to close them. A request that cannot be read,
+    such as one with a negative Content-Length or a line longer than the limit of the stream, is answered with 400.
+
+    Methods:
+    - serve(): Starts the service and serves until cancelled.
+    """
+    MAX_BODY = 1024 * 1024
+
+    def __init__(self, host='127.0.0.1', port=8080, window=0.002, max_batch=512):
+        self.host = host
+        self.port = port
+        self.batcher = MicroBatcher(window, max_batch)
+        self.stats = ServiceStats()
+
+    async def serve(self):
+        """
+        Starts the service and serves until cancelled.
+        """
+        batching = asyncio.create_task(self.batcher.run())
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batching.cancel()
+
+    async def _handle_connection(self, reader, writer):
+        """
+        Answers the requests of a connection until it is closed.
+        """
+        try:
+            while True:
+                try:
+                    request_line = await reader.readline()
+                except ValueError:
+                    request_line = None  # The line is longer than the limit of the stream.
+                if request_line == b'':
+                    break
+                start = time.perf_counter()
+                method, path, headers, body, status = await self._read_request(request_line, reader)
+                # A request that could not be read leaves the connection in an unknown state, so it is closed.
+                keep_alive = status is None and headers.get('connection', '').lower() != 'close'
+                if status is None:
+                    status, response = await self._route(method, path, body)
+                else:
+                    response = {'error': status.phrase}
+                self._write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                self.stats.record(time.perf_counter() - start, status != HTTPStatus.OK)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, request_line, reader):
+        """
+        Reads the headers and body of a request.
+
+        Args:
+        - request_line: The request line, None if it was too long to be read.
+        - reader: StreamReader of the connection, positioned after the request line.
+
+        Returns:
+        - Tuple of the method, path, lower-case headers, body and an error status, None if the request is valid.
+        """
+        try:
+            method, path, _ = request_line.decode('latin-1').split()
+        except (AttributeError, ValueError):
+            return None, None, {}, b'', HTTPStatus.BAD_REQUEST
+        headers = {}
+        try:
+            while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            length = int(headers.get('content-length', 0))
+        except ValueError:  # A header line longer than the limit of the stream, or an invalid length.
+            return method, path, headers, b'', HTTPStatus.BAD_REQUEST
+        if length < 0:
+            return method, path, headers, b'', HTTPStatus.BAD_REQUEST
+        if length > self.MAX_BODY:
+            return method, path, headers, b'', HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+        return method, path, headers, await reader.readexactly(length), None
+
+    async def _route(self, method, path, body):
+        """
+        Answers a request.
+
+        Returns:
+        - Tuple of the status and the JSON-serialisable response.
+        """
+        if path == '/stats':
+            if method != 'GET':
+                return HTTPStatus.METHOD_NOT_ALLOWED, {'error': HTTPStatus.METHOD_NOT_ALLOWED.phrase}
+            return HTTPStatus.OK, self.stats.as_dict(self.batcher)
+        if path != '/solve':
+            return HTTPStatus.NOT_FOUND, {'error': HTTPStatus.NOT_FOUND.phrase}
+        if method != 'POST':
+            return HTTPStatus.METHOD_NOT_ALLOWED, {'error': HTTPStatus.METHOD_NOT_ALLOWED.phrase}
+        try:
+            loans = json.loads(body)
+        except ValueError:
+            return HTTPStatus.BAD_REQUEST, {'error': 'Invalid JSON'}
+        single = isinstance(loans, dict)
+        if single:
+            loans = [loans]
+        if not isinstance(loans, list) or not loans:
+            return HTTPStatus.BAD_REQUEST, {'error': INCORRECT_PARAMETERS}
+        results = await self.batcher.solve(loans)
+        if any(result.get('error') == INTERNAL_ERROR for result in results):
+            return HTTPStatus.INTERNAL_SERVER_ERROR, results[0] if single else results
+        if single:
+            return (HTTPStatus.BAD_REQUEST if 'error' in results[0] else HTTPStatus.OK), results[0]
+        return HTTPStatus.OK, results
+
+    @staticmethod
+    def _write_response(writer, status, response, keep_alive):
+        """
+        Writes a JSON response.
+        """
+        body = json.dumps(response).encode()
+        writer.write(f'HTTP/1.1 {status.value} {status.phrase}\r\n'
+                     f'Content-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode() + body)
+
+
+def parse_arguments():
+    """
+    Parses the command line arguments of the service.
+
+    Returns:
+    - Parsed arguments.
+    """
+    parser = argparse.ArgumentParser(description='Serves loan calculations over HTTP/JSON.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen on')
+    parser.add_argument('--window', type=float, default=2.0, help='milliseconds a batch of requests stays open')
+    parser.add_argument('--max-batch', type=int, default=512, help='number of loans at which a batch is solved')
+    return parser.parse_args()
+
+
+def main():
+    """
+    Main function to run the loan service.
+    """
+    args = parse_arguments()
+    service = LoanService(args.host, args.port, args.window / 1000, args.max_batch)
+    print(f'Serving loan calculations on http://{args.host}:{args.port}')
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()